@@ -0,0 +1,141 @@
+import os
+import shutil
+
+from store import Store
+
+
+FICLONE = 0x40049409
+
+
+def clone_file(src: str, dst: str) -> None:
+    """Copies a file as a copy-on-write reflink where the filesystem supports it (Btrfs, XFS),
+    and as a regular copy otherwise. The destination appears atomically.
+    """
+    part = f"{dst}.part"
+
+    try:
+        import fcntl
+
+        with open(src, "rb") as s, open(part, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        shutil.copystat(src, part)
+    except (ImportError, OSError):
+        shutil.copy2(src, part)
+
+    os.replace(part, dst)
+
+
+def link_file(src: str, dst: str) -> None:
+    """Hard-links dst to src, falling back to clone_file across volumes or on FAT"""
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    try:
+        os.link(src, dst)
+    except OSError:
+        clone_file(src, dst)
+
+
+class BackupIndex:
+    """Content-addressed backup store.
+
+    Each distinct pdf is stored once under '.objects' by MD5; the familiar folder tree
+    in the backup directory is made of hard links into it. The manifest records which version
+    of every working-directory file is backed up, so checking a file is a metadata lookup.
+    The index maps a PDF's MD5 to its backup copy and original access/modification times.
+    """
+
+    def __init__(self, store: Store) -> None:
+        self.store = store
+
+        self.store.execute(
+            """CREATE TABLE IF NOT EXISTS backups (
+                md5 TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                atime REAL NOT NULL,
+                mtime REAL NOT NULL
+            )"""
+        )
+        self.store.execute(
+            """CREATE TABLE IF NOT EXISTS backup_manifest (
+                relpath TEXT PRIMARY KEY,
+                md5 TEXT NOT NULL,
+                -- Name of the object under '.objects'
+                digest TEXT NOT NULL
+            )"""
+        )
+        self.store.commit()
+
+    def is_backed_up(self, relpath: str, md5: str) -> bool:
+        row = self.store.fetchone(
+            "SELECT md5 FROM backup_manifest WHERE relpath = ?", (relpath,)
+        )
+
+        return row is not None and row[0] == md5
+
+    @staticmethod
+    def _object_path(backup_directory: str, digest: str) -> str:
+        return os.path.join(backup_directory, ".objects", digest[:2], f"{digest}.pdf")
+
+    def add(self, src: str, backup_directory: str, relpath: str, md5: str) -> str:
+        """Stores src under its MD5 and links it at relpath. Returns the backup path.
+
+        The object of the version backed up before is deleted once no other file links to it.
+        """
+        object_path = self._object_path(backup_directory, md5)
+
+        previous = self.store.fetchone(
+            "SELECT digest FROM backup_manifest WHERE relpath = ?", (relpath,)
+        )
+
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            clone_file(src, object_path)
+
+        output_file = os.path.join(backup_directory, relpath)
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        link_file(object_path, output_file)
+
+        self.store.execute(
+            "INSERT OR REPLACE INTO backup_manifest (relpath, md5, digest) VALUES (?, ?, ?)",
+            (relpath, md5, md5),
+        )
+        self.store.commit()
+
+        if previous is not None and previous[0] != md5:
+            self._remove_unused(backup_directory, previous[0])
+
+        return output_file
+
+    def _remove_unused(self, backup_directory: str, digest: str) -> None:
+        if self.store.fetchone("SELECT 1 FROM backup_manifest WHERE digest = ?", (digest,)):
+            return
+
+        object_path = self._object_path(backup_directory, digest)
+
+        try:
+            os.remove(object_path)
+
+            # The prefix folder, if that was its last object
+            os.rmdir(os.path.dirname(object_path))
+        except OSError:
+            pass
+
+    def lookup(self, md5: str) -> tuple | None:
+        """Returns (backup path, atime, mtime)"""
+        return self.store.fetchone(
+            "SELECT path, atime, mtime FROM backups WHERE md5 = ?", (md5,)
+        )
+
+    def record(self, md5: str, path: str, atime: float, mtime: float, replace: bool = True) -> None:
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+
+        self.store.execute(
+            f"{verb} INTO backups (md5, path, atime, mtime) VALUES (?, ?, ?, ?)",
+            (md5, path, atime, mtime),
+        )
+        self.store.commit()
+
+
+if __name__ == "__main__":
+    pass
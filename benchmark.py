@@ -0,0 +1,413 @@
+"""Benchmark of the scan pipeline on a synthetic corpus.
+
+Generates N pdfs (mixed page counts; text-layer, image-only, encrypted and already tagged ones),
+a large ledger and a populated Backup folder in a temporary directory, then runs the pipeline
+twice -- a cold run that processes everything and a warm run that should find nothing to do.
+ocrmypdf is stubbed by default; --real-ocr runs it for real.
+
+Per-stage timings (from metrics.py), wall time and peak memory of every run are written as JSON,
+so results can be compared across commits:
+
+    python benchmark.py --files 200 --output bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+
+from types import SimpleNamespace
+from datetime import datetime
+
+import pikepdf
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+LOREM = (
+    "Lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+    "incididunt ut labore et dolore magna aliqua Ut enim ad minim veniam quis nostrud"
+)
+
+# A4 at 150 dpi
+PAGE_SIZE = (595, 842)
+IMAGE_SIZE = (1240, 1754)
+
+# Seconds per page the stubbed OCR sleeps; passed to the spawned workers through the environment
+STUB_DELAY = "OCR_BENCHMARK_SECONDS_PER_PAGE"
+
+
+# Corpus
+# ---------------------------
+def _add_text_page(pdf, rng: random.Random) -> None:
+    page = pdf.add_blank_page(page_size=PAGE_SIZE)
+
+    lines = [f"BT /F1 11 Tf 56 {790 - 14 * n} Td ({LOREM[rng.randrange(40):]}) Tj ET" for n in range(50)]
+
+    page.Resources = pikepdf.Dictionary(
+        Font=pikepdf.Dictionary(
+            F1=pikepdf.Dictionary(
+                Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1, BaseFont=pikepdf.Name.Helvetica
+            )
+        )
+    )
+    page.Contents = pdf.make_stream("\n".join(lines).encode())
+
+
+def _add_image_page(pdf, rng: random.Random) -> None:
+    """A grey 'scan': white paper with lines of noise where the text would be"""
+    width, height = IMAGE_SIZE
+    pixels = bytearray(b"\xff" * width * height)
+
+    for y in range(120, height - 120, 36):
+        x0 = rng.randrange(100, 200)
+        x1 = rng.randrange(width // 2, width - 100)
+
+        for row in range(y, y + 18):
+            start = row * width
+            pixels[start + x0 : start + x1] = rng.randbytes(x1 - x0)
+
+    image = pikepdf.Stream(pdf, zlib.compress(bytes(pixels), 6))
+    image.Type = pikepdf.Name.XObject
+    image.Subtype = pikepdf.Name.Image
+    image.Width = width
+    image.Height = height
+    image.ColorSpace = pikepdf.Name.DeviceGray
+    image.BitsPerComponent = 8
+    image.Filter = pikepdf.Name.FlateDecode
+
+    page = pdf.add_blank_page(page_size=PAGE_SIZE)
+    page.Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(Im0=image))
+    page.Contents = pdf.make_stream(f"q {PAGE_SIZE[0]} 0 0 {PAGE_SIZE[1]} 0 0 cm /Im0 Do Q".encode())
+
+
+def make_pdf(path: str, pages: int, kind: str, rng: random.Random, pdf_id: str | None = None) -> None:
+    with pikepdf.new() as pdf:
+        for _ in range(pages):
+            if kind == "text" or (kind == "mixed" and rng.random() < 0.5):
+                _add_text_page(pdf, rng)
+            else:
+                _add_image_page(pdf, rng)
+
+        if pdf_id is not None:
+            pdf.docinfo["/Keywords"] = f"md5 {pdf_id}"
+
+        if kind == "encrypted":
+            pdf.save(path, encryption=pikepdf.Encryption(owner="benchmark", user="", R=4))
+        else:
+            pdf.save(path)
+
+
+def make_corpus(root: str, args) -> dict:
+    """Returns a summary of what was generated"""
+    from functions import get_ledger
+
+    rng = random.Random(args.seed)
+
+    working_directory = os.path.join(root, "work")
+    kinds = ["text", "image", "mixed", "encrypted", "tagged"]
+    weights = [30, 30, 20, 10, 10]
+    summary = {kind: 0 for kind in kinds}
+    summary["pages"] = 0
+
+    ledger = get_ledger()
+
+    for n in range(args.files):
+        kind = rng.choices(kinds, weights)[0]
+        pages = min(args.max_pages, rng.choice([1, 1, 1, 2, 3, 5, 10, 40]))
+
+        folder = os.path.join(working_directory, f"folder-{n % 10}")
+        os.makedirs(folder, exist_ok=True)
+
+        path = os.path.join(folder, f"{n:05d}.pdf")
+
+        if kind == "tagged":
+            pdf_id = f"{rng.getrandbits(128):032x}"
+            make_pdf(path, pages, "text", rng, pdf_id)
+            ledger.record(pdf_id, "2024-01-01", os.path.basename(path))
+        else:
+            make_pdf(path, pages, kind, rng)
+
+        summary[kind] += 1
+        summary["pages"] += pages
+
+    # Ledger of documents OCRed before
+    for _ in range(args.ledger_rows):
+        ledger.record(f"{rng.getrandbits(128):032x}", "2024-01-01", "old.pdf")
+
+    ledger.flush()
+
+    # Backup folder of earlier runs, which every walk has to skip
+    with pikepdf.new() as pdf:
+        pdf.add_blank_page(page_size=PAGE_SIZE)
+        pdf.save(os.path.join(root, "blank.pdf"))
+
+    backup_directory = os.path.join(working_directory, "Backup", "old")
+    os.makedirs(backup_directory, exist_ok=True)
+
+    for n in range(args.backup_files):
+        shutil.copyfile(os.path.join(root, "blank.pdf"), os.path.join(backup_directory, f"{n:05d}.pdf"))
+
+    summary["ledger_rows"] = args.ledger_rows
+    summary["backup_files"] = args.backup_files
+
+    return summary
+
+
+def write_config(root: str, args) -> None:
+    from functions import read_yaml, write_yaml
+
+    config = read_yaml(os.path.join(ROOT, "config.yaml"), cached=False)
+    config["WORKING_DIRECTORY"] = os.path.join(root, "work")
+    config["BACKUP_DIRECTORY"] = "Backup"
+    config["force_rescan"] = False
+    config["watch"] = False
+    config["metrics"] = True
+    config["metrics_port"] = 0
+    write_yaml(os.path.join(root, "config.yaml"), config)
+
+    ocr = read_yaml(os.path.join(ROOT, "ocr.yaml"), cached=False)
+    ocr["workers"] = args.workers
+    write_yaml(os.path.join(root, "ocr.yaml"), ocr)
+
+
+# Pipeline
+# ---------------------------
+def stub_ocr(i, o, pdf_id, problematic, config, jobs=0, incremental=False, pages=None) -> int:
+    """Stands in for ocr.ocr: embeds the ID and sleeps for each page"""
+    from ocr import tag_pdf, count_pages
+
+    time.sleep(float(os.environ.get(STUB_DELAY, 0.05)) * count_pages(i))
+
+    return tag_pdf(i, o, pdf_id)
+
+
+class QuietTray:
+    def notify(self, message: str, passthrough=False) -> None:
+        pass
+
+    def update_menu(self, status) -> None:
+        pass
+
+
+class FakeScheduler:
+    def get_jobs(self) -> list:
+        return [SimpleNamespace(next_run_time=datetime.now(), modify=lambda **kwargs: None)]
+
+
+def _peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@contextlib.contextmanager
+def stdout_to_stderr():
+    """Sends the pipeline's output -- worker processes' included -- to stderr,
+    so that stdout only carries the JSON
+    """
+    sys.stdout.flush()
+    saved = os.dup(1)
+    os.dup2(2, 1)
+
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+def run_pipeline(name: str) -> dict:
+    """One scheduled tick: walk, cleanup, process, cleanup.
+
+    Memory is reported as peak RSS only: tracing allocations would slow down the stages being timed.
+    """
+    import main
+    import functions
+
+    functions.get_metrics.cache_clear()
+    metrics = functions.get_metrics()
+
+    start = time.perf_counter()
+
+    with metrics.stage("walk"):
+        files = functions.ls(functions.get_config().working_directory)
+
+    main.cleanup()
+    main.process(files, FakeScheduler(), QuietTray(), complete=True)
+    main.cleanup()
+
+    seconds = time.perf_counter() - start
+
+    return {
+        "name": name,
+        "seconds": round(seconds, 4),
+        "files": len(files),
+        "stages": {
+            stage: {"seconds": round(metrics.stage_seconds[stage], 4), "runs": metrics.stage_runs[stage]}
+            for stage in sorted(metrics.stage_seconds)
+        },
+        "documents": dict(metrics.documents),
+        "errors": dict(metrics.errors),
+        "pages": metrics.pages,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def run_preprocessor(root: str, count: int) -> dict:
+    """Thresholds and re-encodes the first N image-only documents"""
+    from preprocessor import PdfPreprocessor
+
+    paths = []
+    for dirpath, _, files in os.walk(os.path.join(root, "work")):
+        if "Backup" in dirpath:
+            continue
+
+        for file in sorted(files):
+            path = os.path.join(dirpath, file)
+
+            with pikepdf.open(path) as pdf:
+                if "/XObject" in pdf.pages[0].Resources:
+                    paths.append(path)
+
+    timings = []
+    for path in paths[:count]:
+        start = time.perf_counter()
+
+        pp = PdfPreprocessor(path, lazy=True)
+        pp.threshold_images().run()
+        pp.images_to_pdf()
+        pp.cleanup()
+
+        timings.append(time.perf_counter() - start)
+
+    return {"documents": len(timings), "seconds": round(sum(timings), 4)}
+
+
+def get_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks the scan pipeline on a synthetic corpus.")
+    parser.add_argument("--files", type=int, default=100, help="number of pdfs to generate")
+    parser.add_argument("--max-pages", type=int, default=40, help="upper bound of pages per pdf")
+    parser.add_argument("--ledger-rows", type=int, default=20_000, help="unrelated ledger entries")
+    parser.add_argument("--backup-files", type=int, default=1_000, help="files in the Backup folder")
+    parser.add_argument("--workers", type=int, default=0, help="'workers' in ocr.yaml; 0 -- auto")
+    parser.add_argument("--real-ocr", action="store_true", help="runs ocrmypdf instead of the stub")
+    parser.add_argument("--stub-seconds-per-page", type=float, default=0.05)
+    parser.add_argument("--preprocess", type=int, default=0, help="also times PdfPreprocessor on N image pdfs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keeps the corpus directory")
+    parser.add_argument("--output", default="-", help="JSON output file; '-' -- stdout")
+    args = parser.parse_args()
+
+    os.environ[STUB_DELAY] = str(args.stub_seconds_per_page)
+
+    root = tempfile.mkdtemp(prefix="ocr-benchmark-")
+    cwd = os.getcwd()
+
+    # ocr.db, the ledger, config files and metrics are all relative to the working directory
+    os.chdir(root)
+    sys.path.insert(0, ROOT)
+
+    try:
+        with stdout_to_stderr():
+            results = run(root, args)
+    finally:
+        os.chdir(cwd)
+
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+        else:
+            print(f"Corpus kept in '{root}'", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+    problems = validate(results)
+
+    for problem in problems:
+        print(problem, file=sys.stderr)
+
+    if len(problems) > 0:
+        sys.exit(1)
+
+
+def run(root: str, args) -> dict:
+    write_config(root, args)
+
+    start = time.perf_counter()
+    corpus = make_corpus(root, args)
+    corpus["seconds"] = round(time.perf_counter() - start, 4)
+
+    import main as app
+
+    if not args.real_ocr:
+        # Workers are spawned, so the stub must be importable from this module
+        app.ocr = stub_ocr
+
+    results = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "arguments": vars(args),
+        "corpus": corpus,
+        "runs": [run_pipeline("cold"), run_pipeline("warm")],
+    }
+
+    if args.preprocess > 0:
+        results["preprocessor"] = run_preprocessor(root, args.preprocess)
+
+    return results
+
+
+def validate(results: dict) -> list[str]:
+    """Timings of a run that didn't do its work are meaningless: the cold run must OCR every
+    generated document that isn't tagged yet, and the warm run must find nothing to do
+    """
+    corpus = results["corpus"]
+    cold, warm = results["runs"]
+
+    problems = []
+
+    expected = results["arguments"]["files"] - corpus["tagged"]
+    if cold["documents"] != {"done": expected}:
+        problems.append(f"Cold run: expected {expected} documents done, got {cold['documents']}.")
+
+    if cold["errors"]:
+        problems.append(f"Cold run: errors {cold['errors']}.")
+
+    if warm["documents"] or warm["errors"]:
+        problems.append(f"Warm run: expected nothing to do, got {warm['documents']}, errors {warm['errors']}.")
+
+    return problems
+
+if __name__ == "__main__":
+    main()
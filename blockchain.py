@@ -1,7 +1,21 @@
+import os
 import hashlib
 import json
 
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from threading import Lock
+
+from store import Store
+
+
+# Keys of a block's data that identify the document it records
+DOC_ID_KEYS = ("pdf_id", "md5")
+
+# Blocks per Merkle root
+MERKLE_SPAN = 1024
+# Blocks per verification job
+VERIFY_SEGMENT = 10_000
 
 
 class Blockchain:
@@ -39,5 +53,450 @@ class Blockchain:
         }
 
 
+def _leaf(block_hash: str) -> bytes:
+    return hashlib.sha256(b"\x00" + bytes.fromhex(block_hash)).digest()
+
+
+def _node(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+def _next_level(level: list) -> list:
+    # An odd node out is carried up as it is
+    return [
+        _node(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+        for i in range(0, len(level), 2)
+    ]
+
+
+def merkle_root(hashes: list[str]) -> str:
+    """Root over block hashes"""
+    level = [_leaf(block_hash) for block_hash in hashes]
+
+    while len(level) > 1:
+        level = _next_level(level)
+
+    return level[0].hex()
+
+
+def merkle_path(hashes: list[str], position: int) -> list:
+    """Sibling hashes from the leaf at position up to the root, as [hash, 'left' | 'right']"""
+    level = [_leaf(block_hash) for block_hash in hashes]
+
+    path = []
+    while len(level) > 1:
+        sibling = position ^ 1
+
+        if sibling < len(level):
+            path.append([level[sibling].hex(), "left" if sibling < position else "right"])
+
+        level = _next_level(level)
+        position = position // 2
+
+    return path
+
+
+def verify_proof(block: dict, proof: dict) -> bool:
+    """Checks that block is the one proven and that its path leads to the proof's root.
+
+    The root itself must be compared with a trusted copy, see BlockLog.verify_proof().
+    """
+    block_hash = hashlib.md5(json.dumps(block).encode()).hexdigest()
+
+    if block_hash != proof["hash"] or block.get("index") != proof["index"]:
+        return False
+
+    node = _leaf(block_hash)
+    for sibling, side in proof["path"]:
+        sibling = bytes.fromhex(sibling)
+        node = _node(sibling, node) if side == "left" else _node(node, sibling)
+
+    return node.hex() == proof["root"]
+
+
+def _verify_segment(path: str, rows: list, previous_hash: str) -> int | None:
+    """Checks consecutive blocks against their indexed hashes and links.
+
+    Module-level so that segments can be checked in worker processes.
+    Returns the index of the first bad block.
+    """
+    with open(path, "rb") as f:
+        for (idx, offset, length, block_hash) in rows:
+            f.seek(offset)
+            line = f.read(length)
+
+            if hashlib.md5(line).hexdigest() != block_hash:
+                return idx
+
+            block = json.loads(line)
+            if block["index"] != idx or block["previous_hash"] != previous_hash:
+                return idx
+
+            previous_hash = block_hash
+
+    return None
+
+
+def _doc_id(block: dict) -> str | None:
+    data = block.get("data")
+
+    if isinstance(data, dict):
+        for key in DOC_ID_KEYS:
+            if key in data:
+                return str(data[key])
+
+    return None
+
+
+class BlockLog:
+    """Append-only block storage.
+
+    Blocks are stored one per line, serialised exactly as Blockchain._hashify hashes them, so a
+    block's hash is the MD5 of its line. The store indexes every line by block index and document
+    ID, and keeps a checkpoint of the last verified block so that verification resumes from there.
+    """
+
+    def __init__(self, store: Store, path: str = "blockchain.log") -> None:
+        self.store = store
+        self.path = os.path.abspath(path)
+
+        self.lock = Lock()
+
+        self.store.execute(
+            """CREATE TABLE IF NOT EXISTS blocks (
+                log TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                doc_id TEXT,
+                PRIMARY KEY (log, idx)
+            )"""
+        )
+        self.store.execute("CREATE INDEX IF NOT EXISTS blocks_doc_id ON blocks (log, doc_id)")
+        self.store.execute(
+            """CREATE TABLE IF NOT EXISTS block_checkpoints (
+                log TEXT PRIMARY KEY,
+                idx INTEGER NOT NULL,
+                hash TEXT NOT NULL
+            )"""
+        )
+        self.store.execute(
+            """CREATE TABLE IF NOT EXISTS block_roots (
+                log TEXT NOT NULL,
+                first INTEGER NOT NULL,
+                last INTEGER NOT NULL,
+                root TEXT NOT NULL,
+                PRIMARY KEY (log, first)
+            )"""
+        )
+        self.store.commit()
+
+        self._recover()
+        self.update_roots()
+
+    def _recover(self) -> None:
+        """Drops a record torn by a crash mid-append and indexes records the index is missing"""
+        if not os.path.exists(self.path):
+            open(self.path, "ab").close()
+
+        with open(self.path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+
+            end = size
+            while end > 0:
+                f.seek(max(0, end - 4096))
+                chunk = f.read(end - max(0, end - 4096))
+
+                if b"\n" in chunk:
+                    end = end - len(chunk) + chunk.rindex(b"\n") + 1
+                    break
+
+                end = max(0, end - 4096)
+
+            if end < size:
+                f.truncate(end)
+
+        # Rows of records that are no longer in the file
+        self.store.execute(
+            "DELETE FROM blocks WHERE log = ? AND offset + length + 1 > ?", (self.path, end)
+        )
+        for table, column in [("block_checkpoints", "idx"), ("block_roots", "last")]:
+            self.store.execute(
+                f"DELETE FROM {table} WHERE log = ? AND {column} > (SELECT COALESCE(MAX(idx), 0) FROM blocks WHERE log = ?)",
+                (self.path, self.path),
+            )
+
+        row = self.store.fetchone(
+            "SELECT idx, offset, length FROM blocks WHERE log = ? ORDER BY idx DESC LIMIT 1",
+            (self.path,),
+        )
+        idx, offset = (row[0], row[1] + row[2] + 1) if row else (0, 0)
+
+        rows = []
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+
+            for line in f:
+                line = line.rstrip(b"\n")
+                idx = idx + 1
+
+                rows.append(
+                    (self.path, idx, offset, len(line), hashlib.md5(line).hexdigest(), _doc_id(json.loads(line)))
+                )
+                offset = offset + len(line) + 1
+
+        self.store.executemany("INSERT INTO blocks VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.store.commit()
+
+    def __len__(self) -> int:
+        return self.store.fetchone(
+            "SELECT COUNT(*) FROM blocks WHERE log = ?", (self.path,)
+        )[0]
+
+    def append(self, block: dict) -> str:
+        """Writes one record. Returns the block's hash"""
+        line = json.dumps(block).encode()
+        block_hash = hashlib.md5(line).hexdigest()
+
+        with self.lock:
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+
+                f.write(line + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.store.execute(
+                "INSERT INTO blocks VALUES (?, ?, ?, ?, ?, ?)",
+                (self.path, block["index"], offset, len(line), block_hash, _doc_id(block)),
+            )
+            self.store.commit()
+
+            if block["index"] % MERKLE_SPAN == 0:
+                self._store_root(block["index"] - MERKLE_SPAN + 1)
+
+        return block_hash
+
+    # Merkle roots
+    # ---------------------------
+    def _hashes(self, first: int, last: int) -> list[str]:
+        return [
+            row[0]
+            for row in self.store.execute(
+                "SELECT hash FROM blocks WHERE log = ? AND idx BETWEEN ? AND ? ORDER BY idx",
+                (self.path, first, last),
+            )
+        ]
+
+    def _store_root(self, first: int) -> None:
+        last = first + MERKLE_SPAN - 1
+
+        self.store.execute(
+            "INSERT OR REPLACE INTO block_roots VALUES (?, ?, ?, ?)",
+            (self.path, first, last, merkle_root(self._hashes(first, last))),
+        )
+        self.store.commit()
+
+    def update_roots(self) -> None:
+        """Computes the roots of complete ranges that don't have one yet"""
+        stored = {row[0] for row in self.store.execute("SELECT first FROM block_roots WHERE log = ?", (self.path,))}
+
+        for first in range(1, len(self) - MERKLE_SPAN + 2, MERKLE_SPAN):
+            if first not in stored:
+                self._store_root(first)
+
+    def roots(self) -> list[tuple]:
+        """Returns (first index, last index, root) of every complete range"""
+        return self.store.execute(
+            "SELECT first, last, root FROM block_roots WHERE log = ? ORDER BY first", (self.path,)
+        )
+
+    def _range(self, index: int) -> tuple[int, int, str | None]:
+        first = (index - 1) // MERKLE_SPAN * MERKLE_SPAN + 1
+
+        row = self.store.fetchone(
+            "SELECT last, root FROM block_roots WHERE log = ? AND first = ?", (self.path, first)
+        )
+        if row is not None:
+            return (first, row[0], row[1])
+
+        # The range being filled has no stored root yet
+        return (first, first + MERKLE_SPAN - 1, None)
+
+    def prove(self, index: int) -> dict | None:
+        """Proof that a block belongs to its range: about log2(MERKLE_SPAN) hashes"""
+        first, last, root = self._range(index)
+        hashes = self._hashes(first, last)
+
+        if index - first >= len(hashes):
+            return None
+
+        return {
+            "index": index,
+            "hash": hashes[index - first],
+            "first": first,
+            "last": first + len(hashes) - 1,
+            "root": root or merkle_root(hashes),
+            "path": merkle_path(hashes, index - first),
+        }
+
+    def verify_proof(self, block: dict, proof: dict) -> bool:
+        """verify_proof() against the root stored for the block's range"""
+        if not verify_proof(block, proof):
+            return False
+
+        first, _, root = self._range(proof["index"])
+
+        if root is None:
+            root = merkle_root(self._hashes(first, proof["last"]))
+
+        return proof["first"] == first and proof["root"] == root
+
+    def _read(self, rows: list) -> list[dict]:
+        blocks = []
+        with open(self.path, "rb") as f:
+            for (offset, length) in rows:
+                f.seek(offset)
+                blocks.append(json.loads(f.read(length)))
+
+        return blocks
+
+    def get(self, index: int) -> dict | None:
+        rows = self.store.execute(
+            "SELECT offset, length FROM blocks WHERE log = ? AND idx = ?", (self.path, index)
+        )
+
+        return self._read(rows)[0] if rows else None
+
+    def find(self, doc_id: str) -> list[dict]:
+        """Blocks recording a document, oldest first"""
+        return self._read(
+            self.store.execute(
+                "SELECT offset, length FROM blocks WHERE log = ? AND doc_id = ? ORDER BY idx",
+                (self.path, doc_id),
+            )
+        )
+
+    def last(self) -> tuple | None:
+        """Returns (block, hash) of the last block"""
+        row = self.store.fetchone(
+            "SELECT offset, length, hash FROM blocks WHERE log = ? ORDER BY idx DESC LIMIT 1",
+            (self.path,),
+        )
+
+        return (self._read([row[:2]])[0], row[2]) if row else None
+
+    def verify(self, full: bool = False, workers: int = 0) -> int | None:
+        """Checks the chain from the last checkpoint, or from the first block with full=True.
+        Long ranges are split into segments that are checked in parallel processes.
+
+        Returns the index of the first block that doesn't match its hash or link, or None.
+        """
+        start, previous_hash = (1, "0")
+
+        checkpoint = self.store.fetchone(
+            "SELECT idx, hash FROM block_checkpoints WHERE log = ?", (self.path,)
+        )
+        if checkpoint is not None and not full:
+            row = self.store.fetchone(
+                "SELECT offset, length, hash FROM blocks WHERE log = ? AND idx = ?",
+                (self.path, checkpoint[0]),
+            )
+
+            # The checkpointed block itself is only checked against its hash
+            with open(self.path, "rb") as f:
+                f.seek(row[0])
+
+                if row[2] != checkpoint[1] or hashlib.md5(f.read(row[1])).hexdigest() != row[2]:
+                    return checkpoint[0]
+
+            start, previous_hash = (checkpoint[0] + 1, checkpoint[1])
+
+        rows = self.store.execute(
+            "SELECT idx, offset, length, hash FROM blocks WHERE log = ? AND idx >= ? ORDER BY idx",
+            (self.path, start),
+        )
+
+        # Every segment starts from the indexed hash of the block before it
+        segments = [rows[i : i + VERIFY_SEGMENT] for i in range(0, len(rows), VERIFY_SEGMENT)]
+        previous = [previous_hash] + [segment[-1][3] for segment in segments[:-1]]
+
+        workers = min(workers or os.cpu_count() or 1, len(segments))
+
+        if workers <= 1:
+            results = map(_verify_segment, [self.path] * len(segments), segments, previous)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(
+                    executor.map(_verify_segment, [self.path] * len(segments), segments, previous)
+                )
+
+        for bad in results:
+            if bad is not None:
+                return bad
+
+        if len(rows) > 0:
+            self.store.execute(
+                "INSERT OR REPLACE INTO block_checkpoints VALUES (?, ?, ?)",
+                (self.path, rows[-1][0], rows[-1][3]),
+            )
+            self.store.commit()
+
+        return None
+
+
+class PersistentBlockchain(Blockchain):
+    """Blockchain kept in a BlockLog: adding a block writes one record, and blocks are read
+    from disk when asked for instead of being held in memory
+    """
+
+    def __init__(self, data: dict, log: BlockLog) -> None:
+        self.log = log
+
+        if len(self.log) == 0:
+            self.log.append(self._create_block(index=1, data=data, previous_hash="0"))
+
+    @classmethod
+    def from_blockchain(cls, blockchain: Blockchain, log: BlockLog) -> "PersistentBlockchain":
+        """Moves an in-memory (e.g. unpickled) chain to an empty log, block hashes unchanged"""
+        for block in blockchain.chain:
+            log.append(block)
+
+        return cls(blockchain.get_init_block()["data"], log)
+
+    def add_block(self, data: str) -> dict:
+        previous_block, previous_hash = self.log.last()
+        block = self._create_block(
+            index=previous_block["index"] + 1, data=data, previous_hash=previous_hash
+        )
+        self.log.append(block)
+        return block
+
+    def _get_previous_block(self) -> dict:
+        return self.log.last()[0]
+
+    def get_last_block(self) -> dict:
+        return self.log.last()[0]
+
+    def get_init_block(self) -> dict:
+        return self.log.get(1)
+
+    def get_block(self, index: int) -> dict | None:
+        return self.log.get(index)
+
+    def find(self, doc_id: str) -> list[dict]:
+        return self.log.find(doc_id)
+
+    def verify(self, full: bool = False, workers: int = 0) -> int | None:
+        return self.log.verify(full, workers)
+
+    def prove(self, index: int) -> dict | None:
+        return self.log.prove(index)
+
+    def verify_proof(self, block: dict, proof: dict) -> bool:
+        return self.log.verify_proof(block, proof)
+
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,150 @@
+import os
+
+import numpy as np
+import pikepdf
+
+from store import Store
+from fingerprints import stat_signature
+
+
+# Used until enough documents have been OCRed to fit the model
+DEFAULT_SECONDS_PER_PAGE = 10
+MIN_HISTORY = 5
+# Only the most recent documents are fitted, so the model follows hardware and settings changes
+MAX_HISTORY = 500
+
+
+def measure_pdf(path: str) -> tuple[int, float]:
+    """Returns (pages, total image megapixels) without decoding any image"""
+    pixels = 0
+
+    with pikepdf.open(path) as pdf:
+        pages = len(pdf.pages)
+
+        for page in pdf.pages:
+            try:
+                for image in page.images.values():
+                    pixels += int(image.get("/Width", 0)) * int(image.get("/Height", 0))
+            except Exception:
+                pass
+
+    return (pages, pixels / 1_000_000)
+
+
+class CostModel:
+    """Estimates how long a document takes to OCR from its page count, image megapixels and
+    file size, fitted to the measured times of earlier documents
+    """
+
+    def __init__(self, store: Store) -> None:
+        self.store = store
+
+        self.store.execute(
+            """CREATE TABLE IF NOT EXISTS cost_signals (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                pages INTEGER NOT NULL,
+                megapixels REAL NOT NULL
+            )"""
+        )
+        self.store.execute(
+            """CREATE TABLE IF NOT EXISTS cost_history (
+                pdf_id TEXT PRIMARY KEY,
+                pages INTEGER NOT NULL,
+                megapixels REAL NOT NULL,
+                size_mb REAL NOT NULL,
+                seconds REAL NOT NULL,
+                recorded INTEGER NOT NULL
+            )"""
+        )
+        self.store.commit()
+
+        self.coefficients = None
+
+    def signals(self, path: str) -> tuple[int, float, float]:
+        """Returns (pages, megapixels, size in MB)"""
+        signature = stat_signature(path)
+        size_mb = signature[0] / 1024 / 1024
+
+        row = self.store.fetchone(
+            "SELECT size, mtime_ns, inode, pages, megapixels FROM cost_signals WHERE path = ?",
+            (os.path.abspath(path),),
+        )
+        if row is not None and row[:3] == signature:
+            return (row[3], row[4], size_mb)
+
+        pages, megapixels = measure_pdf(path)
+
+        self.store.execute(
+            "INSERT OR REPLACE INTO cost_signals VALUES (?, ?, ?, ?, ?, ?)",
+            (os.path.abspath(path), *signature, pages, megapixels),
+        )
+        self.store.commit()
+
+        return (pages, megapixels, size_mb)
+
+    def fit(self) -> None:
+        """Least-squares fit of seconds against (pages, megapixels, size) over recent history"""
+        rows = self.store.execute(
+            "SELECT pages, megapixels, size_mb, seconds FROM cost_history ORDER BY recorded DESC LIMIT ?",
+            (MAX_HISTORY,),
+        )
+
+        self.coefficients = None
+
+        if len(rows) < MIN_HISTORY:
+            return
+
+        data = np.array(rows, dtype=np.float64)
+        coefficients = np.linalg.lstsq(data[:, :3], data[:, 3], rcond=None)[0]
+
+        # A negative rate would rank bigger documents as cheaper
+        self.coefficients = np.clip(coefficients, 0, None)
+
+    def estimate(self, signals: tuple) -> float:
+        """Predicted OCR time in seconds"""
+        pages = signals[0]
+
+        if self.coefficients is None or not self.coefficients.any():
+            return max(1, pages) * DEFAULT_SECONDS_PER_PAGE
+
+        return max(1.0, float(np.dot(self.coefficients, signals)))
+
+    def record(self, pdf_id: str, signals: tuple, seconds: float) -> None:
+        self.store.execute(
+            """INSERT OR REPLACE INTO cost_history (pdf_id, pages, megapixels, size_mb, seconds, recorded)
+            VALUES (?, ?, ?, ?, ?, (SELECT COALESCE(MAX(recorded), 0) + 1 FROM cost_history))""",
+            (pdf_id, *signals, seconds),
+        )
+        self.store.commit()
+
+
+def get_priority(path: str, working_directory: str, priorities: dict) -> int:
+    """Priority of the deepest configured subfolder that contains path; 0 if there is none"""
+    relpath = os.path.relpath(path, working_directory).replace("\\", "/")
+
+    best = (-1, 0)
+    for folder, priority in priorities.items():
+        folder = folder.replace("\\", "/").strip("/")
+
+        if relpath.startswith(f"{folder}/") and len(folder) > best[0]:
+            best = (len(folder), priority)
+
+    return best[1]
+
+
+def format_eta(seconds: float) -> str:
+    minutes = round(seconds / 60)
+
+    if minutes < 1:
+        return "less than a minute"
+    if minutes < 60:
+        return f"about {minutes} min"
+
+    return f"about {minutes // 60} h {minutes % 60} min"
+
+
+if __name__ == "__main__":
+    pass
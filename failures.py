@@ -0,0 +1,65 @@
+import time
+
+from store import Store
+
+
+# Longest wait before a document that keeps failing is tried again
+MAX_DELAY = 7 * 24 * 60 * 60
+
+
+class FailureIndex:
+    """Failed OCR attempts per document, so a file that keeps failing is retried on a backoff
+    instead of on every run
+    """
+
+    def __init__(self, store: Store) -> None:
+        self.store = store
+
+        self.store.execute(
+            """CREATE TABLE IF NOT EXISTS failures (
+                pdf_id TEXT PRIMARY KEY,
+                attempts INTEGER NOT NULL,
+                next_attempt REAL NOT NULL,
+                error TEXT NOT NULL
+            )"""
+        )
+        self.store.commit()
+
+    def lookup(self, pdf_id: str) -> tuple | None:
+        """Returns (attempts, time of the next attempt, last error)"""
+        return self.store.fetchone(
+            "SELECT attempts, next_attempt, error FROM failures WHERE pdf_id = ?", (pdf_id,)
+        )
+
+    def is_deferred(self, pdf_id: str) -> bool:
+        row = self.lookup(pdf_id)
+
+        return row is not None and row[1] > time.time()
+
+    def record(self, pdf_id: str, error: str) -> int:
+        """Counts a failed attempt. Returns the number of attempts so far"""
+        row = self.lookup(pdf_id)
+        attempts = (row[0] if row else 0) + 1
+
+        self.store.execute(
+            "INSERT OR REPLACE INTO failures (pdf_id, attempts, next_attempt, error) VALUES (?, ?, ?, ?)",
+            (pdf_id, attempts, 0, error),
+        )
+        self.store.commit()
+
+        return attempts
+
+    def defer(self, pdf_id: str, seconds: float) -> None:
+        self.store.execute(
+            "UPDATE failures SET next_attempt = ? WHERE pdf_id = ?",
+            (time.time() + seconds, pdf_id),
+        )
+        self.store.commit()
+
+    def clear(self, pdf_id: str) -> None:
+        self.store.execute("DELETE FROM failures WHERE pdf_id = ?", (pdf_id,))
+        self.store.commit()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,77 @@
+import os
+import hashlib
+
+from store import Store
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path: str) -> str:
+    """MD5 of a file, read in fixed-size chunks"""
+    hasher = hashlib.md5()
+
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            hasher.update(chunk)
+
+    return hasher.hexdigest()
+
+
+def stat_signature(path: str) -> tuple:
+    stat = os.stat(path)
+
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+class FingerprintCache:
+    """Persistent cache of file MD5s keyed on (path, size, mtime, inode).
+
+    Files whose stat signature hasn't changed since they were last hashed are never re-read.
+    """
+
+    def __init__(self, store: Store) -> None:
+        self.store = store
+
+        # Caches from when a second digest was stored next to the MD5 start over
+        if "digest" in [row[1] for row in self.store.execute("PRAGMA table_info(fingerprints)")]:
+            self.store.execute("DROP TABLE fingerprints")
+
+        self.store.execute(
+            """CREATE TABLE IF NOT EXISTS fingerprints (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                md5 TEXT NOT NULL
+            )"""
+        )
+        self.store.commit()
+
+    def get_md5(self, path: str) -> str:
+        signature = stat_signature(path)
+
+        row = self.store.fetchone(
+            "SELECT size, mtime_ns, inode, md5 FROM fingerprints WHERE path = ?",
+            (os.path.abspath(path),),
+        )
+        if row is not None and row[:3] == signature:
+            return row[3]
+
+        md5 = hash_file(path)
+
+        # The file changed while it was being read
+        if stat_signature(path) != signature:
+            return md5
+
+        self.store.execute(
+            "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?)",
+            (os.path.abspath(path), *signature, md5),
+        )
+        self.store.commit()
+
+        return md5
+
+
+if __name__ == "__main__":
+    pass
@@ -1,9 +1,6 @@
 import os
 import sys
-import shutil
-import hashlib
 import functools
-import time
 
 import win32gui
 import win32con
@@ -12,11 +9,21 @@ import pickle
 
 from pathlib import Path
 
-from csv import DictReader, DictWriter
-from tempfile import NamedTemporaryFile
-
 from ruamel.yaml import YAML
 
+from store import open_store
+from ledger import Ledger
+from fingerprints import FingerprintCache
+from backups import BackupIndex
+from probes import ProbeCache
+from failures import FailureIndex
+from workqueue import WorkQueue
+from costs import CostModel
+from metrics import Metrics
+from profiling import Profiler
+from blockchain import BlockLog
+from settings import Config, OcrConfig
+
 
 # Setup
 # ---------------------------
@@ -26,8 +33,10 @@ yaml.default_flow_style = False
 
 fw = win32gui.FindWindowEx(None, None, None, "Tesseract OCR")
 
-
-FIELDNAMES = ["MD5/PDF ID", "Date OCRed", "Name", "Problematic/Force OCR"]
+# path -> ((mtime, size), parsed data)
+yaml_cache: dict[str, tuple] = {}
+# path -> (parsed data, validated snapshot)
+snapshots: dict[str, tuple] = {}
 
 
 # ---------------------------
@@ -57,6 +66,7 @@ def show_console() -> None:
     win32gui.ShowWindow(fw, win32con.SW_SHOW)
 
 
+# Superseded by get_block_log(); kept to read chains pickled by earlier versions
 def load_blockchains() -> list:
     try:
         with open("blockchains.pkl", "rb") as f:
@@ -70,15 +80,53 @@ def save_blockchains(blockchain: dict) -> None:
         pickle.dump(blockchain, f)
 
 
-def read_yaml(path: str) -> dict:
+def read_yaml(path: str, cached: bool = True) -> dict:
+    """Parses a YAML file once and reuses it until the file changes.
+
+    Pass cached=False to get a private copy that is safe to modify and write back.
+    """
     try:
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+
+        if cached and path in yaml_cache and yaml_cache[path][0] == key:
+            return yaml_cache[path][1]
+
         with open(path, "r", encoding="utf-8") as f:
-            return yaml.load(f)
+            data = yaml.load(f)
 
     except FileNotFoundError:
         print(f"{path} is not found. Exiting.")
         sys.exit()
 
+    if cached:
+        yaml_cache[path] = (key, data)
+
+    return data
+
+
+def _get_snapshot(path: str, cls):
+    data = read_yaml(path)
+
+    # Rebuilt only when read_yaml has re-parsed the file
+    if path not in snapshots or snapshots[path][0] is not data:
+        try:
+            snapshots[path] = (data, cls.from_dict(data))
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"Missing or invalid setting {e} in '{path}'.")
+
+    return snapshots[path][1]
+
+
+def get_config() -> Config:
+    """Raises ValueError for invalid settings"""
+    return _get_snapshot("config.yaml", Config)
+
+
+def get_ocr_config() -> OcrConfig:
+    """Raises ValueError for invalid settings"""
+    return _get_snapshot("ocr.yaml", OcrConfig)
+
 
 def write_yaml(path: str, data: dict) -> None:
     try:
@@ -89,104 +137,58 @@ def write_yaml(path: str, data: dict) -> None:
         sys.exit()
 
 
-def get_md5(path: str) -> str:
-    with open(path, "rb") as f:
-        md5 = hashlib.md5(f.read()).hexdigest()
-        f.close()
-        return md5
-
-
-def retry(times=99999, message=None):
-    def decorator_retry(func):
-        @functools.wraps(func)
-        def wrapper_retry(*args, **kwargs):
-            tries = 0
-            success = False
-            while tries < times and not success:
-                try:
-                    func(*args, **kwargs)
-                    success = True
-                except PermissionError:
-                    if message != None:
-                        st = args[0]
-                        if st:
-                            st.notify(message, passthrough=True)
-                        else:
-                            print(message)
-                    time.sleep(15)
-                    tries += 1
-
-        return wrapper_retry
-
-    return decorator_retry
-
-
-@retry(
-    message="Unable to update the MD5 log. Please close any program that uses the file."
-)
-def write_to_log(st, line: str, update: bool = False) -> None:
-    if update == False:
-        with open("md5_log.csv", "a", encoding="utf-8") as f:
-            f.write(line + "\n")
-            f.close()
-    else:
-        temporary_file = NamedTemporaryFile(mode="w", newline="", delete=False)
-        dictwriter = DictWriter(temporary_file, fieldnames=FIELDNAMES)
-
-        l = line.strip().split(",")
-        id = l[0].strip()
-        date = l[1].strip()
-        name = l[2].strip()
-        problematic = l[-1].strip()
-
-        with open("md5_log.csv", "r", encoding="utf-8") as f, temporary_file:
-            dictreader = DictReader(f, fieldnames=FIELDNAMES)
-
-            for i in dictreader:
-                if i[FIELDNAMES[0]] == id:
-                    i[FIELDNAMES[1]] = date
-                    i[FIELDNAMES[2]] = name
-                    i[FIELDNAMES[-1]] = problematic
-
-                dictwriter.writerow(i)
-
-        shutil.move(temporary_file.name, "md5_log.csv")
-
-
-def check_ocrd(pdf_id: str) -> tuple:
-    try:
-        with open("md5_log.csv", "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            if len(lines) == 0:
-                raise FileNotFoundError
+@functools.lru_cache(maxsize=None)
+def get_probes() -> ProbeCache:
+    return ProbeCache(open_store())
 
-            for e, line in enumerate(lines):
-                if e == 0:
-                    continue
 
-                md5_date_ocrd = line.strip().split(",")
+@functools.lru_cache(maxsize=None)
+def get_block_log(path: str = "blockchain.log") -> BlockLog:
+    return BlockLog(open_store(), path)
 
-                md5 = md5_date_ocrd[0].strip()
-                date_ocrd = md5_date_ocrd[1].strip()
 
-                force_ocr = md5_date_ocrd[-1].strip()
-                if force_ocr == "1":
-                    problematic = True
-                else:
-                    problematic = False
+@functools.lru_cache(maxsize=None)
+def get_profiler() -> Profiler:
+    return Profiler()
 
-                if md5 == pdf_id:
-                    return (date_ocrd, problematic)
-            return (None, None)
-    except FileNotFoundError:
-        with open("md5_log.csv", "w", encoding="utf-8") as f:
-            f.write("MD5/PDF ID,Date OCRed,Name,Problematic/Force OCR" + "\n")
-        return (None, None)
+
+@functools.lru_cache(maxsize=None)
+def get_metrics() -> Metrics:
+    return Metrics(enabled=get_config().metrics)
+
+
+@functools.lru_cache(maxsize=None)
+def get_costs() -> CostModel:
+    return CostModel(open_store())
+
+
+@functools.lru_cache(maxsize=None)
+def get_work_queue() -> WorkQueue:
+    return WorkQueue(open_store())
+
+
+@functools.lru_cache(maxsize=None)
+def get_failures() -> FailureIndex:
+    return FailureIndex(open_store())
+
+
+@functools.lru_cache(maxsize=None)
+def get_backup_index() -> BackupIndex:
+    return BackupIndex(open_store())
+
+
+@functools.lru_cache(maxsize=None)
+def get_fingerprints() -> FingerprintCache:
+    return FingerprintCache(open_store())
+
+
+@functools.lru_cache(maxsize=None)
+def get_ledger() -> Ledger:
+    return Ledger(open_store())
 
 
 def ls(path: str = ".", all: bool = False, exts: list = ["pdf"]) -> list:
-    config = read_yaml("config.yaml")
-    backup_directory = config["BACKUP_DIRECTORY"].split("\\")[-1]
+    backup_directory = get_config().backup_directory_name
     files_recursive = []
     for root, dirs, files in os.walk(path):
         if backup_directory in dirs:
@@ -0,0 +1,232 @@
+import os
+
+from csv import reader, writer
+
+from store import Store
+
+
+FIELDNAMES = ["MD5/PDF ID", "Date OCRed", "Name", "Problematic/Force OCR"]
+
+
+class Ledger:
+    """OCR ledger indexed by PDF ID.
+
+    SQLite is the source of truth; 'md5_log.csv' is kept as an editable export.
+    The CSV is re-imported whenever its modification time changes, so marking
+    a file as problematic by hand still works. New rows are appended to it; it is
+    only rewritten when existing rows change.
+
+    Rows are committed in batches of batch_size for bulk callers; the pipeline commits
+    each document's row itself before marking the file done.
+    """
+
+    def __init__(self, store: Store, csv_path: str = "md5_log.csv", batch_size: int = 50) -> None:
+        self.store = store
+        self.csv_path = csv_path
+        self.batch_size = batch_size
+
+        # Rows waiting for the next group commit. Rows committed since the last export:
+        # new ones, which are appended to the CSV, and changed ones, which need a full export
+        self.pending: dict[str, tuple] = {}
+        self.added: dict[str, tuple] = {}
+        self.changed: dict[str, tuple] = {}
+
+        self.store.execute(
+            """CREATE TABLE IF NOT EXISTS ledger (
+                pdf_id TEXT PRIMARY KEY,
+                date_ocrd TEXT,
+                name TEXT,
+                problematic INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        self.store.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self.store.commit()
+
+    def lookup(self, pdf_id: str) -> tuple:
+        """Returns (date OCRed, problematic) or (None, None) for unknown IDs"""
+        row = self.pending.get(pdf_id)
+        if row is None:
+            row = self.store.fetchone(
+                "SELECT pdf_id, date_ocrd, name, problematic FROM ledger WHERE pdf_id = ?",
+                (pdf_id,),
+            )
+        if row is None:
+            return (None, None)
+
+        _, date_ocrd, _, problematic = row
+
+        return (date_ocrd or None, bool(problematic))
+
+    def problematic(self) -> set:
+        """PDF IDs marked problematic, i.e. to be OCRed again"""
+        ids = {pdf_id for (pdf_id,) in self.store.execute("SELECT pdf_id FROM ledger WHERE problematic = 1")}
+
+        for (pdf_id, _, _, problematic) in self.pending.values():
+            if problematic:
+                ids.add(pdf_id)
+            else:
+                ids.discard(pdf_id)
+
+        return ids
+
+    def record(self, pdf_id: str, date_ocrd: str, name: str, problematic: bool = False) -> None:
+        self.pending[pdf_id] = (
+            pdf_id,
+            str(date_ocrd),
+            name.replace(",", "_"),
+            int(problematic),
+        )
+
+        if len(self.pending) >= self.batch_size:
+            self.commit()
+
+    def _upsert(self, rows: list) -> None:
+        self.store.executemany(
+            """INSERT INTO ledger (pdf_id, date_ocrd, name, problematic) VALUES (?, ?, ?, ?)
+            ON CONFLICT (pdf_id) DO UPDATE SET
+                date_ocrd = excluded.date_ocrd,
+                name = excluded.name,
+                problematic = excluded.problematic""",
+            rows,
+        )
+        self.store.commit()
+
+    def commit(self) -> None:
+        if len(self.pending) == 0:
+            return
+
+        ids = list(self.pending)
+        existing = set()
+        for first in range(0, len(ids), 500):
+            part = ids[first : first + 500]
+            existing.update(
+                pdf_id
+                for (pdf_id,) in self.store.execute(
+                    f"SELECT pdf_id FROM ledger WHERE pdf_id IN ({','.join('?' * len(part))})",
+                    tuple(part),
+                )
+            )
+
+        self._upsert(list(self.pending.values()))
+
+        for pdf_id, row in self.pending.items():
+            # Rows not exported yet are still new to the CSV
+            if pdf_id in self.added or pdf_id not in existing:
+                self.added[pdf_id] = row
+            else:
+                self.changed[pdf_id] = row
+
+        self.pending.clear()
+
+    def flush(self) -> bool:
+        """Commits pending rows, imports edits made to the CSV meanwhile and updates it:
+        new rows are appended, changed rows need a full export.
+
+        Returns False if the CSV is locked by another program;
+        the update is retried on the next flush.
+        """
+        self.commit()
+        self.sync()
+
+        exists = os.path.exists(self.csv_path)
+
+        if len(self.changed) == 0 and len(self.added) == 0 and exists:
+            return True
+
+        try:
+            if len(self.changed) == 0 and exists:
+                self.append_csv(list(self.added.values()))
+            else:
+                self.export_csv()
+        except PermissionError:
+            return False
+
+        self.added.clear()
+        self.changed.clear()
+
+        return True
+
+    def _get_meta(self, key: str) -> str | None:
+        row = self.store.fetchone("SELECT value FROM meta WHERE key = ?", (key,))
+
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self.store.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+        )
+        self.store.commit()
+
+    def sync(self) -> int:
+        """Imports the CSV if it was edited since the last import or export"""
+        try:
+            mtime = str(os.stat(self.csv_path).st_mtime_ns)
+        except FileNotFoundError:
+            return 0
+
+        if mtime == self._get_meta("csv_mtime"):
+            return 0
+
+        count = self.import_csv()
+
+        # Rows recorded since the last export are newer than the CSV's copy of them
+        self._upsert(list(self.added.values()) + list(self.changed.values()))
+
+        self._set_meta("csv_mtime", mtime)
+
+        return count
+
+    def import_csv(self) -> int:
+        rows = []
+        with open(self.csv_path, "r", encoding="utf-8", newline="") as f:
+            for e, line in enumerate(reader(f)):
+                if e == 0 or len(line) < 2:
+                    continue
+
+                pdf_id = line[0].strip()
+                date_ocrd = line[1].strip()
+                name = ",".join(line[2:-1]).strip() if len(line) > 3 else ""
+                problematic = 1 if line[-1].strip() == "1" else 0
+
+                rows.append((pdf_id, date_ocrd, name, problematic))
+
+        self.commit()
+        self._upsert(rows)
+
+        return len(rows)
+
+    def export_csv(self) -> None:
+        temporary_file = f"{self.csv_path}.export"
+
+        with open(temporary_file, "w", encoding="utf-8", newline="") as f:
+            w = writer(f, lineterminator="\n")
+            w.writerow(FIELDNAMES)
+            w.writerows(
+                self.store.execute(
+                    "SELECT pdf_id, date_ocrd, name, problematic FROM ledger ORDER BY rowid"
+                )
+            )
+
+        os.replace(temporary_file, self.csv_path)
+
+        self._set_meta("csv_mtime", str(os.stat(self.csv_path).st_mtime_ns))
+
+    def append_csv(self, rows: list) -> None:
+        with open(self.csv_path, "rb+") as f:
+            # A hand-edited CSV may lack the final line break
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) not in b"\r\n":
+                    f.write(b"\n")
+
+        with open(self.csv_path, "a", encoding="utf-8", newline="") as f:
+            writer(f, lineterminator="\n").writerows(rows)
+
+        self._set_meta("csv_mtime", str(os.stat(self.csv_path).st_mtime_ns))
+
+
+if __name__ == "__main__":
+    pass
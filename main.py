@@ -1,13 +1,13 @@
 import os
 import shutil
-from datetime import datetime, date
+import tempfile
+from datetime import datetime, date, timedelta
 import time
 
 import traceback
 import warnings
-import filecmp
 
-from threading import Thread
+from threading import Thread, Lock
 from pathlib import Path
 
 from subprocess import SubprocessError, CalledProcessError, TimeoutExpired
@@ -23,17 +23,28 @@ from ocrmypdf.exceptions import (
 
 import win32api, win32con
 
-from pypdf import PdfReader, PdfWriter
-from pypdf.generic import IndirectObject
-
 from system_tray import SystemTray
-from ocr import ocr
+from settings import Config, OcrConfig
+from watcher import Watcher
+from supervisor import Supervisor
+from failures import MAX_DELAY
+from workqueue import DISCOVERED, BACKED_UP, DECRYPTED, OCR_RUNNING, DONE, FAILED
+from ocr import ocr, prepare_chunks, merge_pdfs, decrypt_pdf
+from costs import get_priority, format_eta
+from profiling import run_profiled
 from functions import (
-    check_ocrd,
-    get_md5,
+    get_ledger,
+    get_fingerprints,
+    get_backup_index,
+    get_probes,
+    get_failures,
+    get_work_queue,
+    get_costs,
+    get_metrics,
+    get_profiler,
     ls,
-    read_yaml,
-    write_to_log,
+    get_config,
+    get_ocr_config,
     get_file_a_m_time,
     set_file_a_m_time,
     get_file_size_kb,
@@ -41,116 +52,252 @@ from functions import (
 )
 
 
-def decrypt() -> None:
+def decrypt(files: list | None = None) -> list:
+    """Returns the files that are not encrypted (anymore)"""
     print("Searching for encrypted pdfs...")
 
-    config = read_yaml("config.yaml")
+    config = get_config()
+
+    if files is None:
+        files = ls(path=config.working_directory)
 
-    files = ls(path=config["WORKING_DIRECTORY"])
+    probes = get_probes()
+    metrics = get_metrics()
 
     count = 0
+    ok = []
     for (name, path) in files:
-        writer = PdfWriter()
+        try:
+            with metrics.stage("probe"):
+                _, encrypted = probes.get(path)
+        except Exception as e:
+            print(" ", f"'{name}':", str(e))
 
-        pdf = PdfReader(path)
+            continue
 
-        if pdf.is_encrypted == True:
+        if encrypted == False:
+            ok.append((name, path))
+        else:
             print(" ", f"'{name}' is encrypted.")
 
             try:
                 print("   ", "Decrypting in place...")
 
-                pdf.decrypt("")
+                with metrics.stage("decrypt", name=name):
+                    win32api.SetFileAttributes(path, win32con.FILE_ATTRIBUTE_NORMAL)
+                    decrypt_pdf(path)
 
-                for page in pdf.pages:
-                    writer.add_page(page)
+                # Caches the decrypted file as unencrypted, so it isn't opened again
+                if probes.get(path)[1] == True:
+                    raise ValueError(f"'{name}' is still encrypted after decryption.")
+            except Exception as e:
+                print("   ", str(e))
 
-                win32api.SetFileAttributes(path, win32con.FILE_ATTRIBUTE_NORMAL)
-                with open(path, "wb") as f:
-                    writer.write(f)
-            except Exception:
-                raise
+                metrics.error(type(e).__name__)
             else:
                 print(" ", f"'{name}' decrypted successfully.")
 
                 count = count + 1
+                ok.append((name, path))
 
     print(f"Decrypted {count} file(s).")
     print()
 
+    return ok
 
-def backup() -> None:
-    config = read_yaml("config.yaml")
+
+def backup(files: list | None = None) -> list:
+    """Returns the files that are backed up or don't need to be"""
+    config = get_config()
 
     # ---------------------------
-    if config["WORKING_DIRECTORY"] == config["BACKUP_DIRECTORY"]:
-        raise ValueError("Backup directory cannot be the same as working directory.")
-    else:
-        backup_directory_path = os.path.join(
-            config["WORKING_DIRECTORY"], config["BACKUP_DIRECTORY"]
-        )
+    backup_directory_path = config.backup_directory_path
     Path(backup_directory_path).mkdir(exist_ok=True, parents=True)
 
     # ---------------------------
     print("Creating backup of unscanned pdfs...")
 
-    files = ls(config["WORKING_DIRECTORY"])
+    if files is None:
+        files = ls(config.working_directory)
+
+    fingerprints = get_fingerprints()
+    backups = get_backup_index()
+    probes = get_probes()
+    metrics = get_metrics()
 
     count = 0
+    ok = []
     for (name, path) in files:
-        with open(path, "rb") as f:
-            reader = PdfReader(f)
+        input_file = path
+        relpath = os.path.relpath(input_file, config.working_directory)
 
-            pdf_id = reader.metadata.get("/Keywords", "")
-            # creator = reader.metadata.get("/Creator", "")
+        try:
+            with metrics.stage("probe"):
+                pdf_id = probes.get_pdf_id(path)
+        except Exception as e:
+            print(str(e))
 
-        input_file = path
-        relpath = os.path.relpath(input_file, config["WORKING_DIRECTORY"])
-        output_file = os.path.join(backup_directory_path, relpath)
+            continue
 
-        if not isinstance(pdf_id, str) or not pdf_id.startswith(
-            "md5"
-        ):  # and not "ocrmypdf" in creator:
+        if pdf_id is not None:
+            # OCRed before, so the original is backed up already
+            ok.append((name, path))
+        else:
             try:
-                os.makedirs(os.path.dirname(output_file), exist_ok=True)
+                # Read before hashing, which may update the access time
+                atime, mtime = get_file_a_m_time(input_file)
 
-                if not os.path.exists(output_file) or not filecmp.cmp(
-                    input_file, output_file, shallow=False
+                with metrics.stage("hash"):
+                    md5 = fingerprints.get_md5(input_file)
+
+                if backups.is_backed_up(relpath, md5) and os.path.exists(
+                    os.path.join(backup_directory_path, relpath)
                 ):
-                    shutil.copy2(input_file, output_file)
+                    ok.append((name, path))
+
+                    continue
+
+                with metrics.stage("backup", name=name):
+                    output_file = backups.add(input_file, backup_directory_path, relpath, md5)
 
-                    print(" ", f"'{name}'")
+                print(" ", f"'{name}'")
 
-                    count = count + 1
+                count = count + 1
+
+                if backups.lookup(md5) is None:
+                    backups.record(md5, output_file, atime, mtime)
+
+                ok.append((name, path))
             except PermissionError:
                 pass
             except Exception as e:
                 print(str(e))
 
+                metrics.error(type(e).__name__)
+
     print(f"Copied {count} file(s).")
     print()
 
+    return ok
+
+
+def index_backups(config: Config) -> None:
+    """Indexes backups made before the backup index existed"""
+    print("Indexing existing backups...")
+
+    fingerprints = get_fingerprints()
+    backups = get_backup_index()
+
+    for _, path in ls(path=config.backup_directory_path):
+        atime, mtime = get_file_a_m_time(path)
+        backups.record(fingerprints.get_md5(path), path, atime, mtime, replace=False)
+
+
+def get_cpu_budget(ocr_config: OcrConfig, files: int) -> tuple[int, int]:
+    """Splits the CPU budget between documents OCRed at the same time.
+
+    Returns (number of workers, ocrmypdf jobs per document)
+    """
+    budget = ocr_config.jobs or os.cpu_count() or 1
+
+    workers = ocr_config.workers or max(1, budget // 2)
+    workers = max(1, min(workers, files, budget))
+
+    return (workers, max(1, budget // workers))
+
+
+def finish_document(document: dict) -> int:
+    """Returns the document's exit code or raises the error of its first failed chunk"""
+    if document["error"] is not None:
+        raise document["error"]
+
+    exit_code = max(document["exit_codes"], default=0)
+
+    if document["chunks"] is not None and exit_code == 0:
+        print("Merging OCRed chunks...")
+
+        merge_pdfs(
+            document["output_file"],
+            document["outputs"],
+            document["input_file"],
+            document["pdf_id"],
+        )
+
+    return exit_code
+
+
+def submit_ocr(supervisor, profiler, document: dict, tasks: list, ocr_config, jobs: int) -> list:
+    """Submits the OCR of a document, or of its chunks: (input, output, pages) tasks"""
+    submitted = []
+
+    for n, (i, o, pages) in enumerate(tasks, start=1):
+        args = (i, o, document["pdf_id"], document["problematic"], ocr_config, jobs)
+
+        # Chunks come with their pages selected
+        if document["chunks"] is not None:
+            kwargs = {"pages": pages}
+        else:
+            kwargs = {"incremental": not document["date_ocrd"]}
+
+        if document["profile"] == True:
+            label = f"{document['name']}-{n}" if len(tasks) > 1 else document["name"]
+
+            task = supervisor.submit(run_profiled, profiler.directory, label, ocr, *args, **kwargs)
+        else:
+            task = supervisor.submit(ocr, *args, **kwargs)
+
+        submitted.append(task)
+
+    return submitted
+
+
+def remove_files(paths: list) -> None:
+    for path in paths:
+        try:
+            win32api.SetFileAttributes(path, win32con.FILE_ATTRIBUTE_NORMAL)
+            os.remove(path)
+        except Exception as e:
+            print(str(e))
+
+
+def get_status(scheduler) -> str:
+    return f"Next OCR run on: {scheduler.get_jobs()[0].next_run_time.strftime('%B %d, %H:%M:%S')}"
+
+
+def get_eta(documents: list, workers: int) -> str:
+    seconds = sum(document["cost"] for document in documents) / workers
+    end = datetime.now() + timedelta(seconds=seconds)
+
+    return f"OCRing {len(documents)} file(s). Done in {format_eta(seconds)} ({end.strftime('%H:%M')})"
+
 
 first_run = True
 run_counter = 0
 
+# Keeps the scheduled sweep and the watcher from working on the same files
+scan_lock = Lock()
+
 
 def scan(scheduler, st) -> None:
-    config = read_yaml("config.yaml")
+    try:
+        config = get_config()
+    except ValueError as e:
+        st.notify(str(e))
+
+        return
 
     # Resets scheduler's run time for SystemTray.
     # Because a job's next scheduled run time is unknown (not exposed) before the first run,
     # We simulate this run to get the time but return before doing the actual work.
     # All consecutive jobs run normally.
     # ---------------------------
-    status = f"Next OCR run on: {scheduler.get_jobs()[0].next_run_time.strftime('%B %d, %H:%M:%S')}"
-    st.update_menu(status)
+    st.update_menu(get_status(scheduler))
 
     global first_run
     if first_run == True:
         first_run = False
 
-        if config["run_first_job_immediately_on_startup"] == False:
+        if config.run_first_job_immediately_on_startup == False:
             return
 
     # ---------------------------
@@ -158,10 +305,33 @@ def scan(scheduler, st) -> None:
     run_counter = run_counter + 1
     print("========================", f"Run {run_counter}", "========================")
 
-    cleanup()
+    with scan_lock:
+        cleanup()
+
+        with get_metrics().stage("walk"):
+            files = ls(config.working_directory)
+
+        process(files, scheduler, st, complete=True)
+
+        cleanup()
 
+
+def process_new(files: list, scheduler, st) -> None:
+    """Processes files picked up by the watcher"""
+    with scan_lock:
+        print("========================", "New files", "========================")
+
+        process(files, scheduler, st)
+
+        cleanup()
+
+
+def process(files: list, scheduler, st, complete: bool = False) -> None:
+    """OCRs files. With complete=True, files is the whole working directory"""
+    # Settings are validated once up front instead of per document
     try:
-        backup()
+        config = get_config()
+        ocr_config = get_ocr_config()
     except ValueError as e:
         st.notify(str(e))
 
@@ -169,164 +339,473 @@ def scan(scheduler, st) -> None:
 
         return
 
-    try:
-        decrypt()
-    except Exception as e:
-        st.notify(str(e))
+    ledger = get_ledger()
+    if ledger.sync() > 0:
+        print("Imported changes from 'md5_log.csv'.")
+        print()
+
+    # Only new and changed files, and files left unfinished, have work to do
+    work = get_work_queue()
+    pending = work.discover(files, complete, forced=ledger.problematic())
+
+    if config.force_rescan == True:
+        pending = files
+
+    for (_, path) in backup([f for f in pending if work.state(f[1]) == DISCOVERED]):
+        work.advance(path, BACKED_UP)
+
+    for (_, path) in decrypt([f for f in pending if work.state(f[1]) == BACKED_UP]):
+        work.advance(path, DECRYPTED)
+
+    # Files that were OCRing when the app stopped are restored by cleanup() and start over
+    states = [DECRYPTED, OCR_RUNNING, FAILED]
+    if config.force_rescan == True:
+        states.append(DONE)
+
+    pending = [f for f in pending if work.state(f[1]) in states]
 
     # ---------------------------
-    files = ls(config["WORKING_DIRECTORY"])
+    fingerprints = get_fingerprints()
+    backups = get_backup_index()
+    backups_indexed = False
+    probes = get_probes()
+    failures = get_failures()
+    costs = get_costs()
+    costs.fit()
+    metrics = get_metrics()
+    profiler = get_profiler()
 
     if len(files) == 0:
-        st.notify(f"No files to OCR in '{config['WORKING_DIRECTORY']}'")
+        st.notify(f"No files to OCR in '{config.working_directory}'")
 
         return
 
     # Start
     # ---------------------------
-    for e, (name, path) in enumerate(files):
+    queue = []
+    for (name, path) in pending:
         print(f"'{path}'")
 
-        with open(path, "rb") as f:
-            reader = PdfReader(f)
+        with metrics.stage("probe"):
+            pdf_id = probes.get_pdf_id(path)
 
-            keywords = reader.metadata.get("/Keywords", "")
-
-        if not isinstance(keywords, str) or not keywords.startswith("md5"):
-            pdf_id = get_md5(path)
+        if pdf_id is None:
+            with metrics.stage("hash"):
+                pdf_id = fingerprints.get_md5(path)
 
             print(
                 "No ID embedded in PDF. Creating new ID from backup file's MD5:", pdf_id
             )
-        else:
-            pdf_id = keywords.split(" ")[1]
 
-        date_ocrd, problematic = check_ocrd(pdf_id)
+        date_ocrd, problematic = ledger.lookup(pdf_id)
 
         print("PDF ID:", pdf_id)
         print("Date OCRed:", date_ocrd)
 
         # ---------------------------
-        if not date_ocrd or problematic or config["force_rescan"]:
+        if failures.is_deferred(pdf_id):
+            print(f"'{name}' failed to OCR before. Skipped until its next retry.")
+        elif not date_ocrd or problematic or config.force_rescan:
+            parts = 1
+
             if get_file_size_kb(path) > 4_000:
                 st.notify(f"'{name}' may take longer to process: large file size.")
 
-            today = date.today()
+            try:
+                signals = costs.signals(path)
+            except Exception as e:
+                print(str(e))
 
-            input_file = path
-            output_file = os.path.join(
-                os.path.dirname(input_file),
-                f"{name}.tmp",
+                signals = (1, 0.0, get_file_size_kb(path) / 1024)
+
+            if ocr_config.big_file_threshold and get_file_size_kb(path) > ocr_config.big_file_threshold:
+                pages = signals[0]
+                parts = -(-pages // ocr_config.chunk_pages)
+
+                if parts > 1:
+                    print(f"Splitting {pages} pages into {parts} chunks...")
+
+            queue.append(
+                {
+                    "name": name,
+                    "input_file": path,
+                    "output_file": os.path.join(os.path.dirname(path), f"{name}.tmp"),
+                    "pdf_id": pdf_id,
+                    "date_ocrd": date_ocrd,
+                    "problematic": problematic,
+                    "parts": parts,
+                    "signals": signals,
+                    "cost": costs.estimate(signals),
+                    "priority": get_priority(path, config.working_directory, config.priorities),
+                    "profile": profiler.select(name, get_file_size_kb(path), config),
+                    # Failed attempts during this run, and when the next one may start
+                    "attempt": 0,
+                    "not_before": 0,
+                }
             )
+        else:
+            print(f"'{name}' was scanned on '{date_ocrd}'. Skipped.")
 
-            try:
-                os.rename(input_file, output_file)
+            work.advance(path, DONE, pdf_id)
 
-                exit_code = ocr(
-                    output_file, input_file, pdf_id, problematic=problematic
-                )
-            except MissingDependencyError as e:
-                st.notify(str(e))
+        print()
 
-                time.sleep(2)
+    if len(queue) == 0:
+        metrics.flush()
 
-                # scheduler.shutdown(wait=False)
+        return
 
-                break
-            except EncryptedPdfError:
-                st.notify(
-                    f"Cannot OCR '{name}'. PDF is encrypted. Please remove any passwords, and the file will be rescanned automatically during the next run."
-                )
+    # Higher priority first, then the cheapest documents, so a huge scan doesn't hold up small ones
+    if config.order == "shortest":
+        queue.sort(key=lambda document: (-document["priority"], document["cost"]))
+    else:
+        queue.sort(key=lambda document: -document["priority"])
+
+    # ---------------------------
+    workers, jobs = get_cpu_budget(ocr_config, sum(document["parts"] for document in queue))
+
+    print(f"OCRing {len(queue)} file(s) with {workers} worker(s), {jobs} job(s) each...")
+    print()
 
-                os.rename(output_file, input_file)
-            except (
-                SubprocessError,
-                CalledProcessError,
-                TimeoutExpired,
-                SubprocessOutputError,
-            ) as e:
-                st.notify(
-                    f"Error processing '{name}'. Restarting the job...",
-                    passthrough=True,
+    st.update_menu(get_eta(queue, workers))
+    metrics.set_queue_depth(len(queue))
+
+    # Each task runs in its own process, so a hung ocrmypdf can be killed without taking down the app
+    supervisor = Supervisor(workers, ocr_config.timeout)
+
+    # task -> document; a document is done when all of its chunks are
+    running = {}
+    finished = []
+    stop = False
+
+    with supervisor:
+        while len(queue) > 0 or len(running) > 0:
+            # Keeps at most N files renamed to .tmp at a time
+            while not stop and len(running) < workers:
+                now = time.monotonic()
+                ready = [document for document in queue if document["not_before"] <= now]
+
+                if len(ready) == 0:
+                    break
+
+                document = ready[0]
+                queue.remove(document)
+
+                document.update(
+                    started=time.monotonic(),
+                    chunks=None,
+                    splitting=None,
+                    outputs=[],
+                    pending=set(),
+                    exit_codes=[],
+                    error=None,
                 )
 
-                os.rename(output_file, input_file)
+                name = document["name"]
+                input_file = document["input_file"]
+                output_file = document["output_file"]
+
+                try:
+                    work.advance(input_file, OCR_RUNNING)
+
+                    os.rename(input_file, output_file)
+
+                    if document["parts"] > 1:
+                        document["chunks"] = tempfile.mkdtemp()
+
+                        # Classifying and splitting a big document takes a while, so it runs in a
+                        # worker too; the chunks are submitted once it is done
+                        select = (
+                            not document["date_ocrd"]
+                            and ocr_config.skip_text_pages
+                            and not document["problematic"]
+                        )
+
+                        document["splitting"] = supervisor.submit(
+                            prepare_chunks,
+                            output_file,
+                            document["chunks"],
+                            ocr_config.chunk_pages,
+                            document["pdf_id"],
+                            select,
+                        )
+                        tasks = [document["splitting"]]
+                    else:
+                        tasks = submit_ocr(
+                            supervisor,
+                            profiler,
+                            document,
+                            [(output_file, input_file, None)],
+                            ocr_config,
+                            jobs,
+                        )
+                except Exception as e:
+                    print(f"'{name}':", str(e))
+                    print()
+
+                    if os.path.exists(output_file):
+                        os.rename(output_file, input_file)
+
+                    work.advance(input_file, DECRYPTED)
+
+                    continue
+
+                for task in tasks:
+                    document["pending"].add(task)
+                    running[task] = document
+
+            if stop:
+                queue.clear()
+
+            if len(queue) == 0 and len(running) == 0:
+                break
 
-                scheduler.get_jobs()[0].modify(next_run_time=datetime.now())
-            except Exception as e:
-                print(str(e))
-                print(traceback.format_exc())
+            # Wakes up for the next retry that is due, if a worker is free for it
+            timeout = None
+            if len(queue) > 0 and len(running) < workers:
+                timeout = max(0, min(document["not_before"] for document in queue) - time.monotonic())
 
-                st.notify(
-                    f"Error processing '{name}'. Please refer to console output.",
-                    passthrough=True,
-                )
+            if len(running) == 0:
+                time.sleep(timeout)
 
-                os.rename(output_file, input_file)
+                continue
 
-                # scheduler.shutdown(wait=False)
+            done = supervisor.wait(running, timeout=timeout)
 
-                break
-            else:
-                # Success. Doesn't write to log if force-rescan is on to avoid duplicate entries
-                if exit_code == 0 and not date_ocrd:
-                    write_to_log(
-                        st, line=f"{pdf_id},{today},{name.replace(',', '_')},0"
-                    )
-                elif exit_code == 0 and problematic:
-                    write_to_log(
-                        st,
-                        line=f"{pdf_id},{today},{name.replace(',', '_')},0",
-                        update=True,
+            for task in done:
+                document = running.pop(task)
+                document["pending"].discard(task)
+
+                if task.cancelled():
+                    pass
+                elif task.exception() is not None:
+                    if document["error"] is None:
+                        document["error"] = task.exception()
+
+                    # The document fails as a whole; skips chunks that haven't started
+                    for other in document["pending"]:
+                        other.cancel()
+                elif task is document["splitting"]:
+                    chunks = task.result()
+                    document["outputs"] = [f"{chunk}.ocr" for (chunk, _) in chunks]
+
+                    for other in submit_ocr(
+                        supervisor,
+                        profiler,
+                        document,
+                        [(chunk, f"{chunk}.ocr", pages) for (chunk, pages) in chunks],
+                        ocr_config,
+                        jobs,
+                    ):
+                        document["pending"].add(other)
+                        running[other] = document
+                else:
+                    document["exit_codes"].append(task.result())
+
+                if len(document["pending"]) > 0:
+                    continue
+
+                name = document["name"]
+                input_file = document["input_file"]
+                output_file = document["output_file"]
+                pdf_id = document["pdf_id"]
+                date_ocrd = document["date_ocrd"]
+                problematic = document["problematic"]
+
+                today = date.today()
+
+                print(f"'{input_file}'")
+
+                result = "done"
+
+                try:
+                    exit_code = finish_document(document)
+
+                    metrics.observe("ocr", time.monotonic() - document["started"], name=name)
+                except MissingDependencyError as e:
+                    result = "error"
+                    metrics.error(type(e).__name__)
+
+                    st.notify(str(e))
+
+                    os.rename(output_file, input_file)
+
+                    work.advance(input_file, DECRYPTED)
+
+                    time.sleep(2)
+
+                    # scheduler.shutdown(wait=False)
+
+                    stop = True
+                except EncryptedPdfError as e:
+                    result = "error"
+                    metrics.error(type(e).__name__)
+
+                    st.notify(
+                        f"Cannot OCR '{name}'. PDF is encrypted. Please remove any passwords, and the file will be rescanned automatically during the next run."
                     )
-                elif exit_code > 0:
+
+                    os.rename(output_file, input_file)
+
+                    # Decryption is tried again on the next run
+                    work.advance(input_file, BACKED_UP)
+                except (
+                    SubprocessError,
+                    CalledProcessError,
+                    TimeoutExpired,
+                    SubprocessOutputError,
+                ) as e:
+                    result = "failed"
+                    metrics.error(type(e).__name__)
+
+                    print(str(e))
+
+                    os.rename(output_file, input_file)
+
+                    # Retries just this file; the rest of the run carries on
+                    attempts = failures.record(pdf_id, str(e))
+                    document["attempt"] = document["attempt"] + 1
+
+                    if document["attempt"] < ocr_config.max_retries and not stop:
+                        delay = ocr_config.retry_backoff * 2 ** (document["attempt"] - 1)
+
+                        st.notify(
+                            f"Error processing '{name}'. Retrying in {delay:g} seconds...",
+                            passthrough=True,
+                        )
+
+                        document["not_before"] = time.monotonic() + delay
+                        queue.append(document)
+
+                        result = "retried"
+                    else:
+                        # Forces OCR next time, after a wait that grows with every failure
+                        ledger.record(pdf_id, date_ocrd or "", name, problematic=True)
+                        failures.defer(
+                            pdf_id, min(ocr_config.retry_backoff * 2 ** attempts, MAX_DELAY)
+                        )
+                        work.advance(input_file, FAILED)
+
+                        st.notify(
+                            f"Error processing '{name}'. Marked as problematic after {document['attempt']} attempt(s).",
+                            passthrough=True,
+                        )
+                except Exception as e:
+                    result = "error"
+                    metrics.error(type(e).__name__)
+
+                    print(str(e))
+                    print(traceback.format_exc())
+
                     st.notify(
-                        f"Error processing '{name}'. Exit code {exit_code}.",
+                        f"Error processing '{name}'. Please refer to console output.",
                         passthrough=True,
                     )
 
                     os.rename(output_file, input_file)
 
-                # ---------------------------
-                print("Setting original access and modification times from backup...")
+                    work.advance(input_file, DECRYPTED)
+
+                    # scheduler.shutdown(wait=False)
+
+                    stop = True
+                else:
+                    # Success. Doesn't write to log if force-rescan is on to avoid duplicate entries
+                    if exit_code == 0 and (not date_ocrd or problematic):
+                        ledger.record(pdf_id, today, name)
+                    elif exit_code > 0:
+                        result = "failed"
+                        metrics.error("ExitCode")
+
+                        st.notify(
+                            f"Error processing '{name}'. Exit code {exit_code}.",
+                            passthrough=True,
+                        )
+
+                        os.rename(output_file, input_file)
+
+                    if exit_code == 0:
+                        failures.clear(pdf_id)
+                        costs.record(pdf_id, document["signals"], time.monotonic() - document["started"])
+
+                        finished.append(output_file)
+
+                    # ---------------------------
+                    print("Setting original access and modification times from backup...")
+
+                    with metrics.stage("timestamps"):
+                        entry = backups.lookup(pdf_id)
+
+                        if entry is None and not backups_indexed:
+                            index_backups(config)
 
-                backup_directory_path = os.path.join(
-                    config["WORKING_DIRECTORY"], config["BACKUP_DIRECTORY"]
+                            backups_indexed = True
+
+                            entry = backups.lookup(pdf_id)
+
+                        if entry is not None:
+                            _, init_atime, init_mtime = entry
+                            set_file_a_m_time(input_file, init_atime, init_mtime)
+
+                    # A done file is only looked up in the ledger again if it is marked problematic,
+                    # so its row is committed first
+                    if exit_code == 0:
+                        ledger.commit()
+
+                    # After the timestamps are restored, so the next run sees the file as unchanged
+                    work.advance(input_file, DONE if exit_code == 0 else FAILED, pdf_id)
+
+                    # a, m = get_file_a_m_time(input_file)
+                    # print("init_atime, init_mtime", init_atime, init_mtime)
+                    # print("a, m", a, m)
+                finally:
+                    if document["chunks"] is not None:
+                        shutil.rmtree(document["chunks"], ignore_errors=True)
+
+                    print()
+
+                metrics.document(
+                    name, result, document["signals"][0], time.monotonic() - document["started"]
                 )
 
-                backup_files = ls(path=backup_directory_path)
+                # Queued documents and documents with chunks still running
+                remaining = queue + list({id(d): d for d in running.values()}.values())
+                st.update_menu(get_eta(remaining, workers))
+                metrics.set_queue_depth(len(remaining))
+                metrics.flush()
 
-                for _, path in backup_files:
-                    backup_md5 = get_md5(path)
-                    if pdf_id == backup_md5:
-                        init_atime, init_mtime = get_file_a_m_time(path)
-                        set_file_a_m_time(input_file, init_atime, init_mtime)
-                        break
+                # cleanup() would restore .tmp files of documents that are still being processed
+                if len(finished) >= config.clean_after:
+                    remove_files(finished)
 
-                # a, m = get_file_a_m_time(input_file)
-                # print("init_atime, init_mtime", init_atime, init_mtime)
-                # print("a, m", a, m)
-            finally:
-                print()
-        else:
-            print(f"'{name}' was scanned on '{date_ocrd}'. Skipped.")
-            print()
+                    finished.clear()
 
-            continue
+    remove_files(finished)
 
-        if (e + 1) % int(config["clean_after"]) == 0:
-            cleanup()
+    st.update_menu(get_status(scheduler))
+
+    if not ledger.flush():
+        st.notify(
+            "Unable to update 'md5_log.csv'. Please close any program that uses the file.",
+            passthrough=True,
+        )
 
     # st.notify("OCR job finished.", passthrough=True)
-    cleanup()
 
 
 def cleanup() -> None:
+    with get_metrics().stage("cleanup"):
+        _cleanup()
+
+    get_metrics().flush()
+
+
+def _cleanup() -> None:
     print("Removing temporary files...")
 
-    config = read_yaml("config.yaml")
+    config = get_config()
 
-    files = ls(path=config["WORKING_DIRECTORY"], exts=["tmp"])
+    files = ls(path=config.working_directory, exts=["tmp"])
 
     count_rem = 0
     count_res = 0
@@ -351,7 +830,12 @@ def cleanup() -> None:
 
 # ---------------------------
 def main():
-    config = read_yaml("config.yaml")
+    try:
+        config = get_config()
+    except ValueError as e:
+        print(str(e), "Exiting.")
+
+        return
         
     # Setup
     # ---------------------------
@@ -376,16 +860,46 @@ def main():
         id="02",  # optional
         # ---------
         trigger="cron",
-        year=config["cron"]["year"],
-        month=config["cron"]["month"],
-        week=config["cron"]["week"],
-        day=config["cron"]["day"],
-        day_of_week=config["cron"]["day_of_week"],
-        hour=config["cron"]["hour"],
-        minute=config["cron"]["minute"],
-        second=config["cron"]["second"],
+        year=config.cron["year"],
+        month=config.cron["month"],
+        week=config.cron["week"],
+        day=config.cron["day"],
+        day_of_week=config.cron["day_of_week"],
+        hour=config.cron["hour"],
+        minute=config.cron["minute"],
+        second=config.cron["second"],
     )
 
+    # Watch mode; the scheduled job keeps running as a periodic sweep
+    # ---------------------------
+    watcher = None
+
+    if config.watch == True:
+
+        def on_new_files(files: list) -> None:
+            process_new(files, scheduler, st)
+
+            watcher.discard(files)
+
+        watcher = Watcher(
+            config.working_directory,
+            callback=on_new_files,
+            exclude=config.backup_directory_name,
+            debounce=config.watch_debounce,
+            poll_interval=config.watch_poll_interval,
+        )
+        watcher.start()
+
+    # Metrics endpoint; 'metrics.prom' is written either way
+    # ---------------------------
+    if config.metrics == True and config.metrics_port > 0:
+        try:
+            get_metrics().serve(config.metrics_port)
+
+            print(f"Serving metrics on http://127.0.0.1:{config.metrics_port}/metrics")
+        except OSError as e:
+            print(str(e))
+
     print("Started. OK.")
     print()
 
@@ -405,6 +919,12 @@ def main():
     except Exception as e:
         print(e)
 
+    if watcher is not None:
+        print("Stopping Watcher...")
+        watcher.stop()
+
+    get_metrics().stop()
+
     # ---------------------------
     print("Exiting...")
 
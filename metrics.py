@@ -0,0 +1,204 @@
+import os
+import json
+import time
+
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+
+# The JSON-lines log is rotated to '<name>.1' above this size
+MAX_LOG_SIZE = 10 * 1024 * 1024
+# Window for the pages-per-minute gauge, in seconds
+RATE_WINDOW = 10 * 60
+
+
+class Metrics:
+    """Pipeline timings and counters.
+
+    Every event is appended to a JSON-lines log; the totals are written in the Prometheus
+    text format to a file and, optionally, served on localhost.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        log_path: str = "metrics.jsonl",
+        prometheus_path: str = "metrics.prom",
+    ) -> None:
+        self.enabled = enabled
+        self.log_path = log_path
+        self.prometheus_path = prometheus_path
+
+        self.lock = Lock()
+
+        self.stage_seconds = defaultdict(float)
+        self.stage_runs = defaultdict(int)
+        self.documents = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.pages = 0
+        self.queue_depth = 0
+
+        # (time, pages) of recently finished documents
+        self.recent = deque()
+
+        self.server = None
+
+    def _log(self, event: str, **fields) -> None:
+        if not self.enabled:
+            return
+
+        line = json.dumps({"time": round(time.time(), 3), "event": event, **fields})
+
+        try:
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > MAX_LOG_SIZE:
+                os.replace(self.log_path, f"{self.log_path}.1")
+
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(str(e))
+
+    @contextmanager
+    def stage(self, stage: str, **fields):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **fields)
+
+    def observe(self, stage: str, seconds: float, **fields) -> None:
+        with self.lock:
+            self.stage_seconds[stage] += seconds
+            self.stage_runs[stage] += 1
+
+            self._log("stage", stage=stage, seconds=round(seconds, 4), **fields)
+
+    def document(self, name: str, result: str, pages: int, seconds: float) -> None:
+        with self.lock:
+            self.documents[result] += 1
+
+            if result == "done":
+                self.pages += pages
+                self.recent.append((time.time(), pages))
+
+            self._log(
+                "document", name=name, result=result, pages=pages, seconds=round(seconds, 3)
+            )
+
+    def error(self, kind: str) -> None:
+        with self.lock:
+            self.errors[kind] += 1
+
+            self._log("error", kind=kind)
+
+    def set_queue_depth(self, depth: int) -> None:
+        with self.lock:
+            self.queue_depth = depth
+
+    def pages_per_minute(self) -> float:
+        now = time.time()
+
+        while len(self.recent) > 0 and self.recent[0][0] < now - RATE_WINDOW:
+            self.recent.popleft()
+
+        return sum(pages for (_, pages) in self.recent) / (RATE_WINDOW / 60)
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+
+        def metric(name: str, kind: str, help: str, samples: list) -> None:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            for labels, value in samples:
+                label = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label}}} {value}" if label else f"{name} {value}")
+
+        with self.lock:
+            metric(
+                "ocr_stage_seconds_total",
+                "counter",
+                "Time spent per pipeline stage.",
+                [({"stage": stage}, round(seconds, 4)) for stage, seconds in self.stage_seconds.items()],
+            )
+            metric(
+                "ocr_stage_runs_total",
+                "counter",
+                "Number of times each pipeline stage ran.",
+                [({"stage": stage}, runs) for stage, runs in self.stage_runs.items()],
+            )
+            metric(
+                "ocr_documents_total",
+                "counter",
+                "Documents processed by result.",
+                [({"result": result}, count) for result, count in self.documents.items()],
+            )
+            metric(
+                "ocr_errors_total",
+                "counter",
+                "Errors by exception type.",
+                [({"kind": kind}, count) for kind, count in self.errors.items()],
+            )
+            metric("ocr_pages_total", "counter", "Pages OCRed.", [({}, self.pages)])
+            metric("ocr_queue_depth", "gauge", "Documents waiting or being OCRed.", [({}, self.queue_depth)])
+            metric(
+                "ocr_pages_per_minute",
+                "gauge",
+                f"Pages OCRed per minute over the last {RATE_WINDOW // 60} minutes.",
+                [({}, round(self.pages_per_minute(), 2))],
+            )
+
+        return "\n".join(lines) + "\n"
+
+    def flush(self) -> None:
+        if not self.enabled:
+            return
+
+        part = f"{self.prometheus_path}.part"
+
+        try:
+            with open(part, "w", encoding="utf-8") as f:
+                f.write(self.render())
+
+            os.replace(part, self.prometheus_path)
+        except OSError as e:
+            print(str(e))
+
+    def serve(self, port: int) -> None:
+        """Serves the Prometheus text on http://127.0.0.1:<port>/metrics"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+
+                    return
+
+                body = metrics.render().encode("utf-8")
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server = None
+
+
+if __name__ == "__main__":
+    pass
@@ -1,17 +1,177 @@
+import os
+
 import ocrmypdf
+import pikepdf
+
+from settings import OcrConfig
+from store import open_store
+from pages import PageIndex, classify_pages, page_ranges, IMAGE
+
+
+def tag_pdf(i, o, pdf_id) -> int:
+    """Embeds the ID without running OCR"""
+    with pikepdf.open(i) as pdf:
+        pdf.docinfo["/Keywords"] = f"md5 {pdf_id}"
+        pdf.save(o)
+
+    return 0
+
+
+def decrypt_pdf(path: str) -> None:
+    """Removes encryption with an empty user password in place.
+
+    The object graph is copied as it is -- outlines, forms and metadata included -- to a file
+    beside the original, which then replaces it atomically.
+    """
+    part = f"{path}.part"
+
+    try:
+        with pikepdf.open(path, password="") as pdf:
+            pdf.save(part, encryption=False)
+
+        os.replace(part, path)
+    except Exception:
+        if os.path.exists(part):
+            os.remove(part)
+
+        raise
+
+
+def count_pages(i) -> int:
+    with pikepdf.open(i) as pdf:
+        return len(pdf.pages)
+
+
+def split_pdf(i, directory: str, chunk_pages: int) -> list[str]:
+    """Splits a pdf into chunks of N pages"""
+    chunks = []
+
+    with pikepdf.open(i) as pdf:
+        for first in range(0, len(pdf.pages), chunk_pages):
+            chunk = pikepdf.new()
+            chunk.pages.extend(pdf.pages[first : first + chunk_pages])
+
+            path = os.path.join(directory, f"chunk-{first + 1:06}.pdf")
+            chunk.save(path)
+            chunks.append(path)
+
+    return chunks
+
+
+def merge_pdfs(i, chunks: list[str], o, pdf_id) -> None:
+    """Merges OCRed chunks back into the original document.
+
+    The original page objects are kept and only receive the OCRed content,
+    so document metadata, bookmarks, links and annotations survive.
+    """
+    with pikepdf.open(i) as pdf:
+        opened = [pikepdf.open(chunk) for chunk in chunks]
+
+        try:
+            ocr_pages = [(chunk, page) for chunk in opened for page in chunk.pages]
+
+            if len(ocr_pages) != len(pdf.pages):
+                raise ValueError("OCRed chunks don't match the original page count.")
 
-from functions import read_yaml
+            for page, (chunk, ocr_page) in zip(pdf.pages, ocr_pages):
+                for key in ["/Contents", "/Resources", "/MediaBox", "/CropBox", "/Rotate"]:
+                    if key in ocr_page.obj:
+                        value = ocr_page.obj[key]
 
+                        # copy_foreign only takes indirect objects, but /MediaBox, /Rotate and often
+                        # /Resources are direct. Direct dictionaries and arrays may still refer to
+                        # objects of the chunk, so they are made indirect there and copied as a whole
+                        if isinstance(value, (pikepdf.Dictionary, pikepdf.Array, pikepdf.Stream)):
+                            if not value.is_indirect:
+                                value = chunk.make_indirect(value)
 
-def ocr(i, o, pdf_id, problematic: bool) -> int:
+                            value = pdf.copy_foreign(value)
+
+                        page.obj[key] = value
+                    elif key in page.obj:
+                        del page.obj[key]
+
+            with pdf.open_metadata() as meta:
+                meta["pdf:Keywords"] = f"md5 {pdf_id}"
+            pdf.docinfo["/Keywords"] = f"md5 {pdf_id}"
+
+            pdf.save(o)
+        finally:
+            for chunk in opened:
+                chunk.close()
+
+
+def index_pages(i, pdf_id) -> list[str]:
+    """Classifies pages and records them under the document's ID"""
+    classes = classify_pages(i)
+    ocr_pages = [e + 1 for e, c in enumerate(classes) if c == IMAGE]
+
+    PageIndex(open_store()).record(pdf_id, classes, page_ranges(ocr_pages))
+
+    print(
+        f"Pages: {len(classes)}, with text: {classes.count('text')}, "
+        f"image-only: {len(ocr_pages)}, blank: {classes.count('blank')}"
+    )
+
+    return classes
+
+
+def _selection(classes: list[str]) -> str | None:
+    """Pages that need OCR: None -- all, '' -- none"""
+    ocr_pages = [e + 1 for e, c in enumerate(classes) if c == IMAGE]
+
+    if len(ocr_pages) == len(classes):
+        return None
+
+    return page_ranges(ocr_pages)
+
+
+def select_pages(i, pdf_id) -> str | None:
+    """Classifies pages and returns the ones that need OCR: None -- all, '' -- none"""
+    return _selection(index_pages(i, pdf_id))
+
+
+def prepare_chunks(i, directory: str, chunk_pages: int, pdf_id, select: bool) -> list[tuple]:
+    """Splits a document into chunks and returns (chunk, pages that need OCR) for each.
+
+    With select, the document is classified once as a whole -- chunks aren't classified again.
+    Runs in a worker, like the OCR of the chunks.
+    """
+    classes = index_pages(i, pdf_id) if select == True else None
+
+    chunks = []
+    for e, chunk in enumerate(split_pdf(i, directory, chunk_pages)):
+        if classes is None:
+            chunks.append((chunk, None))
+        else:
+            chunks.append((chunk, _selection(classes[e * chunk_pages : (e + 1) * chunk_pages])))
+
+    return chunks
+
+
+def ocr(
+    i,
+    o,
+    pdf_id,
+    problematic: bool,
+    config: OcrConfig,
+    jobs: int = 0,
+    incremental: bool = False,
+    pages: str | None = None,
+) -> int:
+    """pages: the pages to OCR (None -- all), if already selected, as for chunks"""
     print("Scanning...")
 
-    config = read_yaml("ocr.yaml")
+    # Only pages without a usable text layer are OCRed; the rest are copied as they are
+    if incremental and config.skip_text_pages and not problematic:
+        pages = select_pages(i, pdf_id)
+
+    if pages == "":
+        print("All pages have a text layer. Embedding the ID only...")
 
-    if int(config["skip_big"]) == 0:
-        raise ValueError("'skip_big' argument cannot be 0. Please refer to 'ocr.yaml'.")
+        return tag_pdf(i, o, pdf_id)
 
-    redo_ocr = config["redo_ocr"]
+    redo_ocr = config.redo_ocr
     if problematic == True:
         print("File was identified as problematic. Forcing OCR...")
         redo_ocr = False
@@ -26,11 +186,11 @@ def ocr(i, o, pdf_id, problematic: bool) -> int:
     else:
         # remove_background = True
         force_ocr = True
-        deskew = config["deskew"]
-        clean = config["clean"]
-        unpaper_args = config["unpaper_args"]
+        deskew = config.deskew
+        clean = config.clean
+        unpaper_args = config.unpaper_args
 
-    if config["logging"] == False:
+    if config.logging == False:
         ocrmypdf.configure_logging(verbosity=-1)
         progress_bar = False
     else:
@@ -42,26 +202,27 @@ def ocr(i, o, pdf_id, problematic: bool) -> int:
         o,
         keywords=f"md5 {pdf_id}",
         #
-        use_threads=config["use_threads"],
-        # jobs=1,  # auto
-        l=config["l"],
+        use_threads=config.use_threads,
+        jobs=jobs or None,  # auto
+        l=config.l,
         redo_ocr=redo_ocr,
         force_ocr=force_ocr,
+        pages=pages,
         # skip_text=skip_text,
         # oversample=75,  # ???
-        skip_big=int(config["skip_big"]),
+        skip_big=config.skip_big,
         # Image processing
         # remove_background=remove_background,  # NOT IMPLEMENTED
         deskew=deskew,
-        rotate_pages=config["rotate_pages"],
-        rotate_pages_threshold=config["rotate_pages_threshold"],
+        rotate_pages=config.rotate_pages,
+        rotate_pages_threshold=config.rotate_pages_threshold,
         clean=clean,
         unpaper_args=unpaper_args,
         #
-        output_type=config["output_type"],
-        optimize=config["optimize"],  # includes fast_web_view=0
+        output_type=config.output_type,
+        optimize=config.optimize,  # includes fast_web_view=0
         #
-        sidecar=config["output_txt"],
-        tesseract_timeout=config["tesseract_timeout"],  # ???
+        sidecar=config.output_txt,
+        tesseract_timeout=config.tesseract_timeout,  # ???
         progress_bar=progress_bar,
     )
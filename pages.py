@@ -0,0 +1,117 @@
+from pypdf import PdfReader
+
+from store import Store
+
+
+TEXT = "text"
+IMAGE = "image"
+BLANK = "blank"
+
+# Pages with fewer letters and digits than this are treated as having no usable text layer
+MIN_TEXT_CHARS = 20
+# Content streams shorter than this (in bytes) draw nothing worth OCRing
+MIN_CONTENT_BYTES = 64
+
+
+def _has_images(resources, depth: int = 0) -> bool:
+    try:
+        xobjects = resources["/XObject"].get_object()
+    except (KeyError, TypeError):
+        return False
+
+    for xobject in xobjects.values():
+        xobject = xobject.get_object()
+
+        if xobject.get("/Subtype") == "/Image":
+            return True
+
+        # Images wrapped in form XObjects
+        if xobject.get("/Subtype") == "/Form" and depth < 2 and "/Resources" in xobject:
+            if _has_images(xobject["/Resources"].get_object(), depth + 1):
+                return True
+
+    return False
+
+
+def classify_page(page) -> str:
+    try:
+        text = page.extract_text() or ""
+    except Exception:
+        text = ""
+
+    if sum(c.isalnum() for c in text) >= MIN_TEXT_CHARS:
+        return TEXT
+
+    resources = page.get("/Resources")
+    if resources is not None and _has_images(resources.get_object()):
+        return IMAGE
+
+    contents = page.get_contents()
+    if contents is None or len(contents.get_data()) < MIN_CONTENT_BYTES:
+        return BLANK
+
+    # Vector-only pages, e.g. text converted to outlines
+    return IMAGE
+
+
+def classify_pages(path: str) -> list[str]:
+    with open(path, "rb") as f:
+        return [classify_page(page) for page in PdfReader(f, strict=False).pages]
+
+
+def page_ranges(pages: list[int]) -> str:
+    """[1, 2, 3, 7] -> '1-3,7'"""
+    ranges = []
+    for page in sorted(pages):
+        if len(ranges) > 0 and ranges[-1][1] == page - 1:
+            ranges[-1][1] = page
+        else:
+            ranges.append([page, page])
+
+    return ",".join(
+        str(first) if first == last else f"{first}-{last}" for first, last in ranges
+    )
+
+
+class PageIndex:
+    """Page classification of every document, for reporting"""
+
+    def __init__(self, store: Store) -> None:
+        self.store = store
+
+        self.store.execute(
+            """CREATE TABLE IF NOT EXISTS pages (
+                pdf_id TEXT PRIMARY KEY,
+                pages INTEGER NOT NULL,
+                text INTEGER NOT NULL,
+                image INTEGER NOT NULL,
+                blank INTEGER NOT NULL,
+                ocr_pages TEXT NOT NULL
+            )"""
+        )
+        self.store.commit()
+
+    def record(self, pdf_id: str, classes: list[str], ocr_pages: str) -> None:
+        self.store.execute(
+            "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                pdf_id,
+                len(classes),
+                classes.count(TEXT),
+                classes.count(IMAGE),
+                classes.count(BLANK),
+                ocr_pages,
+            ),
+        )
+        self.store.commit()
+
+    def lookup(self, pdf_id: str) -> tuple | None:
+        """Returns (pages, text, image, blank, OCRed pages)"""
+        return self.store.fetchone(
+            "SELECT pages, text, image, blank, ocr_pages FROM pages WHERE pdf_id = ?",
+            (pdf_id,),
+        )
+
+
+if __name__ == "__main__":
+    pass
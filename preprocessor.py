@@ -1,7 +1,14 @@
 import os
 import subprocess
 import tempfile
+import io
 import shutil
+import struct
+import zlib
+import functools
+
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 
 import pytesseract, cv2
 
@@ -11,58 +18,477 @@ from pytesseract.pytesseract import TesseractError
 from pypdf import PdfReader, PdfWriter
 
 from functions import ls
+from store import open_store
+from orientation import OrientationCache, is_upright, image_hash, downscale, OSD_SIZE
 
 import imutils
 import cv2
 import img2pdf
+import pikepdf
+import numpy as np
+
+from PIL import Image
 
 
 pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
+# pdftocairo's default resolution
+DEFAULT_DPI = 150
+# jbig2enc executable, optional
+JBIG2 = "jbig2"
+# Resolution range used by set_resolution()
+TARGET_DPI = 300
+MAX_DPI = 600
+
+
+def _page_number(path: str) -> int:
+    """pdftocairo names pages '<name>-<page number>.png'"""
+    return int(path.rsplit("-", 1)[1].split(".", 1)[0])
+
+
+def _split_pages(first: int, last: int, n: int) -> list[tuple[int, int]]:
+    """Splits pages first..last into up to n contiguous (first, last) ranges"""
+    pages = last - first + 1
+    n = max(1, min(n, pages))
+    size, rest = divmod(pages, n)
+
+    ranges = []
+    for i in range(n):
+        last = first + size - 1 + (1 if i < rest else 0)
+        ranges.append((first, last))
+        first = last + 1
+
+    return ranges
+
+
+@functools.lru_cache(maxsize=None)
+def _get_orientation_cache() -> OrientationCache:
+    # One connection per worker process
+    return OrientationCache(open_store())
+
+
+def _process_page(
+    path: str, data: bytes | None, ops: list, in_memory: bool, dpi: float | None = None
+) -> bytes | None:
+    """Runs recorded operations on a single page; executed in worker processes.
+
+    dpi is the page's rendering resolution. It is scaled along with the page, so that the
+    encoded image keeps the page's physical size.
+    """
+    if data is not None:
+        im = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        im = cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
+    else:
+        im = PdfPreprocessor._read_image(path)
+
+    size = max(im.shape[:2])
+
+    for op, kwargs in ops:
+        im = getattr(PdfPreprocessor, op)(im, **kwargs)
+
+    if dpi:
+        dpi = dpi * max(im.shape[:2]) / size
+
+    if in_memory:
+        return _encode_png(im, dpi)
+
+    PdfPreprocessor._write_image(im, path, dpi)
+
+
+def _is_bilevel(im) -> bool:
+    if im.ndim == 3:
+        if not ((im[..., 0] == im[..., 1]).all() and (im[..., 1] == im[..., 2]).all()):
+            return False
+
+        im = im[..., 0]
+
+    return bool(((im == 0) | (im == 255)).all())
+
+
+def _set_png_dpi(data: bytes, dpi: float) -> bytes:
+    """Inserts a pHYs chunk after IHDR; OpenCV doesn't write one"""
+    ppm = round(dpi / 0.0254)
+    chunk = b"pHYs" + struct.pack(">IIB", ppm, ppm, 1)
+
+    # 8-byte signature, then IHDR: length, type, 13 bytes of data, CRC
+    return data[:33] + struct.pack(">I", 9) + chunk + struct.pack(">I", zlib.crc32(chunk)) + data[33:]
+
+
+def _encode_png(im, dpi: float | None = None) -> bytes:
+    """Encodes an RGB or grayscale page; black/white pages as 1-bit PNG.
+
+    dpi is stored in the image, so that img2pdf sizes the page from it and not from the pixel count.
+    """
+    if im.ndim == 2 and _is_bilevel(im):
+        buffer = io.BytesIO()
+        Image.fromarray(im).convert("1").save(buffer, format="PNG", dpi=(dpi, dpi) if dpi else None)
+
+        return buffer.getvalue()
+
+    if im.ndim == 3:
+        im = cv2.cvtColor(im, cv2.COLOR_RGB2BGR)
+
+    data = cv2.imencode(".png", im)[1].tobytes()
+
+    if dpi:
+        data = _set_png_dpi(data, dpi)
+
+    return data
+
+
+def _jbig2_encode(im) -> bytes | None:
+    """Encodes a 1-bit image as a JBIG2 generic region stream with jbig2enc, if installed"""
+    if shutil.which(JBIG2) is None:
+        return None
+
+    with tempfile.TemporaryDirectory() as td:
+        path = os.path.join(td, "page.pbm")
+        im.save(path)
+
+        output = subprocess.run([JBIG2, "-p", path], capture_output=True)
+
+    if output.returncode != 0 or len(output.stdout) == 0:
+        return None
+
+    return output.stdout
+
+
+def _pages_to_pdf(pages: list, bilevel: str | None = "g4") -> bytes:
+    """Converts page images (paths or encoded bytes) to a pdf.
+
+    Black/white pages are embedded as 1-bit CCITT G4 streams, or as JBIG2 if bilevel is
+    'jbig2' and jbig2enc is installed; grayscale and colour pages are embedded as they are.
+    """
+    converted = []
+    jbig2 = {}
+
+    for e, page in enumerate(pages):
+        if bilevel == None:
+            converted.append(page)
+
+            continue
+
+        with Image.open(io.BytesIO(page) if isinstance(page, bytes) else page) as im:
+            if im.mode != "1" and not _is_bilevel(np.asarray(im)):
+                converted.append(page)
+
+                continue
+
+            dpi = im.info.get("dpi")
+            im = im.convert("1")
+
+        if bilevel == "jbig2":
+            data = _jbig2_encode(im)
+            if data is not None:
+                jbig2[e] = data
+
+        # Single strip, so that img2pdf embeds the G4 data without re-encoding
+        buffer = io.BytesIO()
+        im.save(buffer, format="TIFF", compression="group4", tiffinfo={278: im.height}, dpi=dpi)
+        converted.append(buffer.getvalue())
+
+    pdf = img2pdf.convert(converted)
+
+    if len(jbig2) == 0:
+        return pdf
+
+    with pikepdf.open(io.BytesIO(pdf)) as document:
+        for e, data in jbig2.items():
+            for _, image in document.pages[e].images.items():
+                image.write(data, filter=pikepdf.Name.JBIG2Decode)
+                image.ColorSpace = pikepdf.Name.DeviceGray
+                image.BitsPerComponent = 1
+
+                if "/DecodeParms" in image:
+                    del image.DecodeParms
+
+        buffer = io.BytesIO()
+        document.save(buffer)
+
+        return buffer.getvalue()
+
 
 class PdfPreprocessor:
-    def __init__(self, path: str) -> None:
+    def __init__(
+        self, path: str, lazy: bool = False, in_memory: bool = False, workers: int = 0
+    ) -> None:
         self.images: list[tuple] | None = None
 
+        # Rendering resolution: None -- pdftocairo's default, "auto" -- per page, see set_resolution()
+        self.resolution: int | str | None = None
+        self.page_resolutions: list[int] | None = None
+
+        # Processes used for rasterisation and per-page work; 0 -- all cores
+        self.workers = workers or os.cpu_count() or 1
+
+        # In lazy mode operations are only recorded and then executed by run() in a single pass:
+        # one decode, all operations, one encode per page
+        self.lazy = lazy
+        self.ops: list[tuple] = []
+
+        # Keeps processed pages as encoded bytes instead of writing them back to disk
+        self.in_memory = in_memory
+        self.buffers: dict[str, bytes] = {}
+
         self.td = tempfile.mkdtemp()
 
         # temporary directory + pdf name
         self.pdf = os.path.join(self.td, path.rsplit("\\", 1)[1])
         shutil.copy2(path, self.pdf)
 
-    def _pdf_to_images(self, image_type="png") -> list:
-        output = subprocess.run(
-            [r".\poppler\bin\pdftocairo", f"-{image_type}", self.pdf],
-            text=True,
-            capture_output=True,
-        )
+    def _page_count(self) -> int:
+        with open(self.pdf, "rb") as f:
+            return len(PdfReader(f).pages)
+
+    def _page_resolutions(self) -> list[int]:
+        """Resolution to render each page at, from its embedded images.
+
+        Scanned pages are rendered at their native resolution, but at least TARGET_DPI
+        so that Tesseract gets enough pixels; pages without images get TARGET_DPI.
+        """
+        resolutions = []
+
+        with open(self.pdf, "rb") as f:
+            for page in PdfReader(f).pages:
+                width = float(page.mediabox.width) / 72
+                height = float(page.mediabox.height) / 72
 
-        print(output)
+                dpi = 0
+                try:
+                    xobjects = page["/Resources"]["/XObject"].get_object()
+                except (KeyError, TypeError):
+                    xobjects = {}
 
-        return ls(path=self.td, exts=["png"])
+                for xobject in xobjects.values():
+                    xobject = xobject.get_object()
+                    if xobject.get("/Subtype") != "/Image":
+                        continue
 
-    def _read_image(self, path: str):
+                    dpi = max(
+                        dpi,
+                        int(xobject["/Width"] / width),
+                        int(xobject["/Height"] / height),
+                    )
+
+                resolutions.append(min(max(dpi, TARGET_DPI), MAX_DPI))
+
+        return resolutions
+
+    def set_resolution(self, dpi: int | None = None):
+        """Renders pages at dpi, or at a per-page resolution if None.
+
+        Replaces upscaling with resize_images(): pdftocairo renders the target resolution
+        directly from the source. Pages already rendered are discarded and rendered again.
+        """
+        self.resolution = dpi or "auto"
+        self.page_resolutions = None
+
+        if self.images != None:
+            for (_, path) in self.images:
+                if os.path.exists(path):
+                    os.remove(path)
+
+            self.images = None
+            self.buffers.clear()
+
+        return self
+
+    def _pdf_to_images(self, image_type="png", first: int = 1, last: int | None = None) -> list:
+        last = last or self._page_count()
+
+        # Consecutive pages rendered at the same resolution: (first, last, dpi)
+        if self.resolution == "auto":
+            if self.page_resolutions == None:
+                self.page_resolutions = self._page_resolutions()
+
+            resolutions = self.page_resolutions
+
+            segments = []
+            for page in range(first, last + 1):
+                dpi = resolutions[page - 1]
+                if len(segments) > 0 and segments[-1][2] == dpi:
+                    segments[-1] = (segments[-1][0], page, dpi)
+                else:
+                    segments.append((page, page, dpi))
+        else:
+            segments = [(first, last, self.resolution)]
+
+        # One pdftocairo process per page range. Page numbers in file names are padded
+        # to the document's page count, so ranges never collide
+        commands = []
+        for (segment_first, segment_last, dpi) in segments:
+            for (range_first, range_last) in _split_pages(segment_first, segment_last, self.workers):
+                command = [r".\poppler\bin\pdftocairo", f"-{image_type}"]
+                if dpi:
+                    command += ["-r", str(dpi)]
+                command += ["-f", str(range_first), "-l", str(range_last), self.pdf]
+
+                commands.append(command)
+
+        running = []
+        while len(commands) > 0 or len(running) > 0:
+            while len(commands) > 0 and len(running) < self.workers:
+                running.append(
+                    subprocess.Popen(
+                        commands.pop(0),
+                        text=True,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                    )
+                )
+
+            process = running.pop(0)
+            stdout, stderr = process.communicate()
+
+            print(subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr))
+
+        # Only the pages just rendered, whatever else the directory holds
+        images = [
+            image
+            for image in ls(path=self.td, exts=[image_type])
+            if first <= _page_number(image[1]) <= last
+        ]
+
+        return sorted(images, key=lambda image: _page_number(image[1]))
+
+    @staticmethod
+    def _read_image(path: str):
         im = cv2.imread(path)
 
         return cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
 
-    def _write_image(self, im, path: str):
-        cv2.imwrite(path, im)
+    @staticmethod
+    def _write_image(im, path: str, dpi: float | None = None):
+        with open(path, "wb") as f:
+            f.write(_encode_png(im, dpi))
+
+    def _page_dpi(self, page: int) -> int:
+        """Resolution page was rendered at"""
+        if self.resolution == "auto":
+            return self.page_resolutions[page - 1]
+
+        return self.resolution or DEFAULT_DPI
+
+    def _apply(self, op: str, **kwargs):
+        self.ops.append((op, kwargs))
+
+        # Lazy mode also defers rasterisation, so that stream_to_pdf() can do it window by window
+        if not self.lazy:
+            self.run()
+
+        return self
+
+    def run(self):
+        """Executes recorded operations, decoding and encoding every page once"""
+        ops, self.ops = self.ops, []
+
+        if len(ops) == 0:
+            return self
 
-    def resize_images(self, n: float = 1.50):
         if self.images == None:
             self.images = self._pdf_to_images()
 
-        for (_, path) in self.images:
-            im = self._read_image(path)
+        self._run_ops(self.images, ops)
+
+        return self
 
-            resized_im = self._resize_image(im, n=n)
+    def _run_ops(self, images: list, ops: list) -> None:
+        paths = [path for (_, path) in images]
+        buffers = [self.buffers.get(path) for path in paths]
+        dpis = [self._page_dpi(_page_number(path)) for path in paths]
 
-            self._write_image(resized_im, path)
+        args = (paths, buffers, repeat(ops), repeat(self.in_memory), dpis)
 
-        return self
+        # map() keeps page order regardless of which worker finishes first
+        if self.workers > 1 and len(paths) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(_process_page, *args))
+        else:
+            results = list(map(_process_page, *args))
+
+        if self.in_memory:
+            for path, result in zip(paths, results):
+                self.buffers[path] = result
+
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _window_size(self, max_memory_mb: int) -> int:
+        """Number of pages whose rasters fit into the memory/disk ceiling"""
+        with open(self.pdf, "rb") as f:
+            box = PdfReader(f).pages[0].mediabox
+
+        if self.resolution == "auto":
+            dpi = MAX_DPI
+        else:
+            dpi = self.resolution or DEFAULT_DPI
+
+        # 8-bit RGB; the decoded page and its processed copy
+        pixels = float(box.width) * float(box.height) * (dpi / 72) ** 2
+        page_bytes = pixels * 3 * 2
+
+        return max(1, int(max_memory_mb * 1024 * 1024 // page_bytes))
+
+    def stream_to_pdf(self, window: int = 0, max_memory_mb: int = 512, bilevel: str | None = "g4"):
+        """Rasterises, processes and converts pages in fixed-size windows.
+
+        Only one window of page images exists at a time. Each window becomes a chunk pdf,
+        and pikepdf copies the chunks' pages into the output while saving, so the final
+        document is never built in memory either. Needs lazy=True, so that no pages are
+        rendered before.
+        """
+        if not self.lazy or self.images != None:
+            raise ValueError("stream_to_pdf() needs a lazy preprocessor whose pages aren't rendered yet.")
+
+        ops, self.ops = self.ops, []
+
+        pages = self._page_count()
+        window = window or self._window_size(max_memory_mb)
 
-    def _resize_image(self, im, n: float):
+        output = pikepdf.Pdf.new()
+        chunks = []
+
+        for first in range(1, pages + 1, window):
+            last = min(first + window - 1, pages)
+
+            images = self._pdf_to_images(first=first, last=last)
+            self._run_ops(images, ops)
+
+            paths = [path for (_, path) in images]
+            if self.in_memory:
+                data = [self.buffers.pop(path) for path in paths]
+            else:
+                data = paths
+
+            chunk = os.path.join(self.td, f"chunk-{first:06}.pdf")
+            with open(chunk, "wb") as f:
+                f.write(_pages_to_pdf(data, bilevel=bilevel))
+
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+            # Kept open: pages are read from the chunk when the output is saved
+            chunks.append(pikepdf.open(chunk))
+            output.pages.extend(chunks[-1].pages)
+
+            print(f"Processed pages {first}-{last} of {pages}.")
+
+        tf = tempfile.NamedTemporaryFile(dir=self.td, delete=False)
+        tf.close()
+
+        output.save(tf.name)
+
+        for chunk in chunks:
+            chunk.close()
+
+        return tf.name
+
+    def resize_images(self, n: float = 1.50):
+        return self._apply("_resize_image", n=n)
+
+    @staticmethod
+    def _resize_image(im, n: float):
         w = int(im.shape[1] * n)
         h = int(im.shape[0] * n)
         dsize = (w, h)
@@ -71,21 +497,13 @@ class PdfPreprocessor:
         # return cv2.resize(im, None, fx=n, fy=n, interpolation=cv2.INTER_CUBIC)
 
     def threshold_images(self):
-        if self.images == None:
-            self.images = self._pdf_to_images()
-
-        for (_, path) in self.images:
-            im = self._read_image(path)
-
-            thresholded_im = self._threshold_image(im)
-
-            self._write_image(thresholded_im, path)
+        return self._apply("_threshold_image")
 
-        return self
-
-    def _threshold_image(self, im):
+    @staticmethod
+    def _threshold_image(im):
         image = im
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         # image = cv2.GaussianBlur(image, (5, 5), 0)
         return cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
 
@@ -94,43 +512,67 @@ class PdfPreprocessor:
         cv2.waitKey(0)
         cv2.destroyAllWindows()
 
-    def images_to_pdf(self):
+    def images_to_pdf(self, bilevel: str | None = "g4"):
+        """bilevel: 'g4', 'jbig2' or None to embed black/white pages as they are"""
+        # In lazy mode the pages are only rendered by run()
+        self.run()
+
         if self.images != None:
-            images = sorted([image[1] for image in self.images])
+            images = sorted(
+                [image[1] for image in self.images], key=_page_number
+            )
+            if self.in_memory:
+                images = [self.buffers[image] for image in images]
+
             tf = tempfile.NamedTemporaryFile(dir=self.td, delete=False)
             with open(tf.name, "wb") as f:
-                f.write(img2pdf.convert(images))
+                f.write(_pages_to_pdf(images, bilevel=bilevel))
 
             return tf.name
 
     def rotate_images(self):
-        if self.images == None:
-            self.images = self._pdf_to_images()
+        return self._apply("_rotate_image_or_keep")
+
+    @staticmethod
+    def _rotate_image_or_keep(im):
+        try:
+            return PdfPreprocessor._rotate_image(im)
+        except TesseractError as e:
+            if "Too few characters" in e.message:
+                raise ValueError("Cannot rotate image.")
+        except Exception as e:
+            print(str(e))
+
+        return im
 
-        for (_, path) in self.images:
-            im = self._read_image(path)
+    @staticmethod
+    def _rotate_image(im):
+        cache = _get_orientation_cache()
 
-            try:
-                rotated_im = self._rotate_image(im)
-            except TesseractError as e:
-                if "Too few characters" in e.message:
-                    raise ValueError("Cannot rotate image.")
-            except Exception as e:
-                print(str(e))
+        key = image_hash(im)
+        rotate = cache.get(key)
+
+        if rotate is None:
+            if is_upright(im):
+                print("ORIENTATION: upright (estimated)")
+
+                rotate = 0
             else:
-                self._write_image(rotated_im, path)
+                # OSD only needs enough pixels to recognise a few characters
+                results = pytesseract.image_to_osd(
+                    downscale(im, OSD_SIZE), output_type=Output.DICT
+                )
 
-        return self
+                print("ORIENTATION:", results["orientation"], "ROTATE:", results["rotate"])
 
-    def _rotate_image(self, im):
-        results = pytesseract.image_to_osd(im, output_type=Output.DICT)
+                rotate = results["rotate"]
 
-        print("ORIENTATION:", results["orientation"], "ROTATE:", results["rotate"])
+            cache.set(key, rotate)
 
-        if results["orientation"] == 0 and results["rotate"] == 0:
+        if rotate == 0:
             return im
 
-        return imutils.rotate_bound(im, angle=results["rotate"])
+        return imutils.rotate_bound(im, angle=rotate)
 
     def add_margins(self, margin: int = 50):
         """Add N pixel margins to PDF"""
@@ -176,14 +618,15 @@ class PdfPreprocessor:
 if __name__ == "__main__":
     pp = PdfPreprocessor(
         # r"C:\Users\Sergey\Desktop\arbeitauslagern-attachments\test in 90 degree (1).pdf"
-        r"C:\Users\Sergey\Desktop\arbeitauslagern-attachments\00.pdf"
+        r"C:\Users\Sergey\Desktop\arbeitauslagern-attachments\00.pdf",
+        lazy=True,
     )
 
     try:
-        pp.threshold_images().rotate_images()
+        pp.threshold_images().rotate_images().run()
     except Exception as e:
         print(e)
-        pp.add_margins().resize_images(n=2).threshold_images().rotate_images()
+        pp.add_margins().set_resolution().threshold_images().rotate_images().run()
 
     processed_pdf = pp.images_to_pdf()
 
@@ -0,0 +1,85 @@
+import os
+
+from pypdf import PdfReader
+
+from store import Store
+from fingerprints import stat_signature
+
+
+def probe_pdf(path: str) -> tuple[str, bool]:
+    """Reads the /Keywords entry and the encryption flag of a pdf.
+
+    PdfReader only parses the cross-reference table and trailer up front,
+    so only the Info dictionary is resolved -- the page tree is never touched.
+    A file handle is passed on purpose: given a path, PdfReader reads the whole file into memory.
+    """
+    with open(path, "rb") as f:
+        reader = PdfReader(f, strict=False)
+
+        encrypted = reader.is_encrypted
+
+        try:
+            metadata = reader.metadata
+            keywords = metadata.get("/Keywords", "") if metadata else ""
+        except Exception:
+            # Encrypted with a non-empty password, or a broken Info dictionary
+            keywords = ""
+
+    if not isinstance(keywords, str):
+        keywords = ""
+
+    return (str(keywords), bool(encrypted))
+
+
+class ProbeCache:
+    """Persistent cache of probe results keyed on (path, size, mtime, inode)"""
+
+    def __init__(self, store: Store) -> None:
+        self.store = store
+
+        self.store.execute(
+            """CREATE TABLE IF NOT EXISTS probes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                keywords TEXT NOT NULL,
+                encrypted INTEGER NOT NULL
+            )"""
+        )
+        self.store.commit()
+
+    def get(self, path: str) -> tuple[str, bool]:
+        """Returns (keywords, encrypted)"""
+        signature = stat_signature(path)
+
+        row = self.store.fetchone(
+            "SELECT size, mtime_ns, inode, keywords, encrypted FROM probes WHERE path = ?",
+            (os.path.abspath(path),),
+        )
+        if row is not None and row[:3] == signature:
+            return (row[3], bool(row[4]))
+
+        keywords, encrypted = probe_pdf(path)
+
+        if stat_signature(path) == signature:
+            self.store.execute(
+                "INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(path), *signature, keywords, int(encrypted)),
+            )
+            self.store.commit()
+
+        return (keywords, encrypted)
+
+    def get_pdf_id(self, path: str) -> str | None:
+        """Returns the ID embedded by a previous OCR run"""
+        keywords, _ = self.get(path)
+
+        if not keywords.startswith("md5") or len(keywords.split(" ")) < 2:
+            return None
+
+        return keywords.split(" ")[1]
+
+
+if __name__ == "__main__":
+    pass
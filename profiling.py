@@ -0,0 +1,97 @@
+import io
+import os
+import re
+import time
+import pstats
+import cProfile
+import fnmatch
+import tracemalloc
+
+from threading import Lock
+
+
+# Rows of the function and allocation tables in a report
+TOP = 30
+
+
+def run_profiled(directory: str, label: str, function, *args, **kwargs):
+    """Runs function under cProfile and tracemalloc and writes '<label>.prof' (pstats; opens in
+    snakeviz) and '<label>.txt' (top functions and allocations) to directory.
+
+    Module-level so that it can be handed to a worker process. cProfile only sees the calling
+    thread: with 'use_threads' the page workers of ocrmypdf show up as time spent waiting.
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    label = re.sub(r"[^\w.-]+", "_", label)
+    label = f"{time.strftime('%Y%m%d-%H%M%S')}-{label}"
+
+    profile = cProfile.Profile()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    profile.enable()
+
+    try:
+        return function(*args, **kwargs)
+    finally:
+        profile.disable()
+        seconds = time.perf_counter() - start
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        )
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        profile.dump_stats(os.path.join(directory, f"{label}.prof"))
+
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(TOP)
+
+        with open(os.path.join(directory, f"{label}.txt"), "w", encoding="utf-8") as f:
+            f.write(f"{label}\n")
+            f.write(f"Wall time: {seconds:.2f} s. Peak traced memory: {peak / 1024 / 1024:.1f} MB\n\n")
+
+            f.write("Top functions by cumulative time\n")
+            f.write(stream.getvalue())
+
+            f.write("\nTop allocations by line\n")
+            for stat in snapshot.statistics("lineno")[:TOP]:
+                f.write(f"{stat}\n")
+
+
+class Profiler:
+    """Picks the documents to profile: the next N documents on request, and with 'profile'
+    turned on, documents whose name matches 'profile_pattern' or whose size reaches
+    'profile_min_size'. Reports go to directory.
+    """
+
+    def __init__(self, directory: str = "profiles") -> None:
+        self.directory = directory
+        self.remaining = 0
+
+        self.lock = Lock()
+
+    def request(self, count: int) -> None:
+        with self.lock:
+            self.remaining = self.remaining + count
+
+    def select(self, name: str, size_kb: float, config) -> bool:
+        with self.lock:
+            if self.remaining > 0:
+                self.remaining = self.remaining - 1
+
+                return True
+
+        if config.profile == False:
+            return False
+
+        if config.profile_pattern and fnmatch.fnmatch(name.lower(), config.profile_pattern.lower()):
+            return True
+
+        return config.profile_min_size > 0 and size_kb >= config.profile_min_size
+
+
+if __name__ == "__main__":
+    pass
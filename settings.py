@@ -0,0 +1,153 @@
+import os
+
+from dataclasses import dataclass, field
+
+
+ORDERS = ["shortest", "folder"]
+
+
+@dataclass(frozen=True)
+class Config:
+    """Validated snapshot of 'config.yaml'"""
+
+    backup_directory: str
+    working_directory: str
+    cron: dict = field(default_factory=dict)
+    watch: bool = False
+    watch_debounce: float = 5
+    watch_poll_interval: float = 10
+    clean_after: int = 5
+    order: str = "shortest"
+    priorities: dict = field(default_factory=dict)
+    force_rescan: bool = False
+    profile: bool = False
+    profile_pattern: str = ""
+    profile_min_size: float = 0
+    metrics: bool = True
+    metrics_port: int = 0
+    show_console: bool = False
+    notifications: bool = False
+    run_first_job_immediately_on_startup: bool = True
+
+    @property
+    def backup_directory_path(self) -> str:
+        # Relative backup directories live inside the working directory
+        return os.path.join(self.working_directory, self.backup_directory)
+
+    @property
+    def backup_directory_name(self) -> str:
+        return self.backup_directory.split("\\")[-1]
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Config":
+        config = cls(
+            backup_directory=str(data["BACKUP_DIRECTORY"]),
+            working_directory=str(data["WORKING_DIRECTORY"]),
+            cron={key: str(value) for key, value in data["cron"].items()},
+            watch=bool(data.get("watch", False)),
+            watch_debounce=float(data.get("watch_debounce", 5)),
+            watch_poll_interval=float(data.get("watch_poll_interval", 10)),
+            clean_after=int(data["clean_after"]),
+            order=str(data.get("order", "shortest")),
+            priorities={
+                str(key): int(value) for key, value in (data.get("priorities") or {}).items()
+            },
+            force_rescan=bool(data["force_rescan"]),
+            profile=bool(data.get("profile", False)),
+            profile_pattern=str(data.get("profile_pattern", "")),
+            profile_min_size=float(data.get("profile_min_size", 0)),
+            metrics=bool(data.get("metrics", True)),
+            metrics_port=int(data.get("metrics_port", 0)),
+            show_console=bool(data["show_console"]),
+            notifications=bool(data["notifications"]),
+            run_first_job_immediately_on_startup=bool(
+                data["run_first_job_immediately_on_startup"]
+            ),
+        )
+
+        if config.working_directory == config.backup_directory:
+            raise ValueError("Backup directory cannot be the same as working directory.")
+        if config.clean_after < 1:
+            raise ValueError("'clean_after' argument must be at least 1. Please refer to 'config.yaml'.")
+        if config.order not in ORDERS:
+            raise ValueError(f"'order' argument must be one of {ORDERS}. Please refer to 'config.yaml'.")
+        if not 0 <= config.metrics_port <= 65535:
+            raise ValueError("'metrics_port' argument must be between 0 and 65535. Please refer to 'config.yaml'.")
+        if config.watch_debounce < 0 or config.watch_poll_interval <= 0:
+            raise ValueError("Watch intervals cannot be negative. Please refer to 'config.yaml'.")
+
+        return config
+
+
+@dataclass(frozen=True)
+class OcrConfig:
+    """Validated snapshot of 'ocr.yaml'"""
+
+    l: str
+    redo_ocr: bool = True
+    deskew: bool = True
+    rotate_pages: bool = True
+    rotate_pages_threshold: float = 5
+    clean: bool = True
+    unpaper_args: str = ""
+    output_type: str = "pdf"
+    optimize: int = 0
+    skip_big: float = 150
+    tesseract_timeout: float = 120
+    use_threads: bool = True
+    workers: int = 0
+    jobs: int = 0
+    skip_text_pages: bool = True
+    big_file_threshold: int = 4000
+    chunk_pages: int = 25
+    timeout: float = 3600
+    max_retries: int = 3
+    retry_backoff: float = 30
+    output_txt: bool = False
+    logging: bool = False
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "OcrConfig":
+        config = cls(
+            l=str(data["l"]),
+            redo_ocr=bool(data["redo_ocr"]),
+            deskew=bool(data["deskew"]),
+            rotate_pages=bool(data["rotate_pages"]),
+            rotate_pages_threshold=float(data["rotate_pages_threshold"]),
+            clean=bool(data["clean"]),
+            unpaper_args=str(data["unpaper_args"]),
+            output_type=str(data["output_type"]),
+            optimize=int(data["optimize"]),
+            skip_big=float(data["skip_big"]),
+            tesseract_timeout=float(data["tesseract_timeout"]),
+            use_threads=bool(data["use_threads"]),
+            workers=int(data.get("workers", 0)),
+            jobs=int(data.get("jobs", 0)),
+            skip_text_pages=bool(data.get("skip_text_pages", True)),
+            big_file_threshold=int(data.get("big_file_threshold", 4000)),
+            chunk_pages=int(data.get("chunk_pages", 25)),
+            timeout=float(data.get("timeout", 3600)),
+            max_retries=int(data.get("max_retries", 3)),
+            retry_backoff=float(data.get("retry_backoff", 30)),
+            output_txt=bool(data["output_txt"]),
+            logging=bool(data["logging"]),
+        )
+
+        if config.skip_big == 0:
+            raise ValueError("'skip_big' argument cannot be 0. Please refer to 'ocr.yaml'.")
+        if config.workers < 0 or config.jobs < 0:
+            raise ValueError("'workers' and 'jobs' arguments cannot be negative. Please refer to 'ocr.yaml'.")
+        if config.chunk_pages < 1:
+            raise ValueError("'chunk_pages' argument must be at least 1. Please refer to 'ocr.yaml'.")
+        if config.timeout < 0 or config.retry_backoff < 0:
+            raise ValueError("'timeout' and 'retry_backoff' arguments cannot be negative. Please refer to 'ocr.yaml'.")
+        if config.max_retries < 1:
+            raise ValueError("'max_retries' argument must be at least 1. Please refer to 'ocr.yaml'.")
+        if config.optimize not in [0, 1, 2, 3]:
+            raise ValueError("'optimize' argument must be between 0 and 3. Please refer to 'ocr.yaml'.")
+
+        return config
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,47 @@
+import sqlite3
+import threading
+import functools
+
+
+class Store:
+    """Thread-safe SQLite database shared by the ledger and the other indexes"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.RLock()
+
+        # The scheduler runs jobs on its own worker threads
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+
+    def execute(self, sql: str, parameters: tuple = ()) -> list:
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def executemany(self, sql: str, parameters: list) -> None:
+        with self.lock:
+            self.connection.executemany(sql, parameters)
+
+    def fetchone(self, sql: str, parameters: tuple = ()) -> tuple | None:
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchone()
+
+    def commit(self) -> None:
+        with self.lock:
+            self.connection.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+@functools.lru_cache(maxsize=None)
+def open_store(path: str = "ocr.db") -> Store:
+    return Store(path)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,270 @@
+import os
+import time
+import signal
+import subprocess
+import multiprocessing
+
+from multiprocessing.connection import wait as wait_for
+from subprocess import SubprocessError, TimeoutExpired
+
+if os.name == "nt":
+    import win32api
+    import win32con
+    import win32job
+
+
+def _run(connection, function, args, kwargs) -> None:
+    # Own process group, so that a hard kill also takes down tesseract and ghostscript
+    if hasattr(os, "setsid"):
+        os.setsid()
+
+    try:
+        result = (True, function(*args, **kwargs))
+    except BaseException as e:
+        result = (False, e)
+
+    try:
+        connection.send(result)
+    except Exception:
+        # Unpicklable exception
+        connection.send((False, SubprocessError(f"{type(result[1]).__name__}: {result[1]}")))
+
+    connection.close()
+
+
+def _create_job(pid: int):
+    """Win32 job object holding pid and every process it starts. Terminating or closing it
+    kills them all, so tesseract and Ghostscript don't outlive a killed worker.
+    """
+    job = win32job.CreateJobObject(None, "")
+
+    info = win32job.QueryInformationJobObject(job, win32job.JobObjectExtendedLimitInformation)
+    info["BasicLimitInformation"]["LimitFlags"] |= win32job.JOB_OBJECT_LIMIT_KILL_ON_JOB_CLOSE
+    win32job.SetInformationJobObject(job, win32job.JobObjectExtendedLimitInformation, info)
+
+    process = win32api.OpenProcess(win32con.PROCESS_SET_QUOTA | win32con.PROCESS_TERMINATE, False, pid)
+    try:
+        win32job.AssignProcessToJobObject(job, process)
+    finally:
+        win32api.CloseHandle(process)
+
+    return job
+
+
+class Task:
+    """A call running in its own child process; mirrors the concurrent.futures.Future interface"""
+
+    def __init__(self, function, args: tuple, kwargs: dict, timeout: float) -> None:
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.timeout = timeout
+
+        self.process = None
+        self.connection = None
+        self.deadline = None
+        self.job = None
+
+        self._done = False
+        self._cancelled = False
+        self._result = None
+        self._exception = None
+
+    def start(self, context) -> None:
+        self.connection, child_connection = context.Pipe(duplex=False)
+
+        self.process = context.Process(
+            target=_run,
+            args=(child_connection, self.function, self.args, self.kwargs),
+            # Not daemonic: with 'use_threads' off, ocrmypdf starts a process pool of its own.
+            # kill() and shutdown() take care of children left running
+            daemon=False,
+        )
+        self.process.start()
+
+        child_connection.close()
+
+        # The spawned child is still importing, so it hasn't started tesseract yet
+        if os.name == "nt":
+            try:
+                self.job = _create_job(self.process.pid)
+            except Exception as e:
+                print(str(e))
+
+        if self.timeout:
+            self.deadline = time.monotonic() + self.timeout
+
+    def _set(self, result=None, exception=None) -> None:
+        self._result = result
+        self._exception = exception
+        self._done = True
+
+        if self.connection is not None:
+            self.connection.close()
+
+        # Kills whatever the worker left running
+        if self.job is not None:
+            self.job.Close()
+            self.job = None
+
+    def kill(self) -> None:
+        if self.process is None or not self.process.is_alive():
+            return
+
+        try:
+            if self.job is not None:
+                win32job.TerminateJobObject(self.job, 1)
+            elif hasattr(os, "killpg"):
+                os.killpg(self.process.pid, signal.SIGKILL)
+            else:
+                subprocess.run(
+                    ["taskkill", "/T", "/F", "/PID", str(self.process.pid)],
+                    capture_output=True,
+                    check=True,
+                )
+        except Exception:
+            self.process.kill()
+
+        self.process.join(5)
+
+    def poll(self) -> bool:
+        """Collects the result if the child has finished; kills it past the deadline"""
+        if self._done:
+            return True
+
+        if self.process is None:
+            return False
+
+        if self.connection.poll():
+            try:
+                ok, value = self.connection.recv()
+            except (EOFError, OSError) as e:
+                ok, value = (False, SubprocessError(f"OCR worker failed: {e}"))
+
+            self.process.join()
+
+            if ok:
+                self._set(result=value)
+            else:
+                self._set(exception=value)
+        elif not self.process.is_alive():
+            self._set(
+                exception=SubprocessError(
+                    f"OCR worker exited unexpectedly with code {self.process.exitcode}."
+                )
+            )
+        elif self.deadline is not None and time.monotonic() > self.deadline:
+            self.kill()
+
+            self._set(exception=TimeoutExpired(self.function.__name__, self.timeout))
+
+        return self._done
+
+    def cancel(self) -> bool:
+        if self.process is not None or self._done:
+            return False
+
+        self._cancelled = True
+        self._done = True
+
+        return True
+
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def done(self) -> bool:
+        return self._done
+
+    def exception(self):
+        return self._exception
+
+    def result(self):
+        if self._exception is not None:
+            raise self._exception
+
+        return self._result
+
+
+class Supervisor:
+    """Runs each task in a child process with a wall-clock deadline.
+
+    At most N children run at a time; a child that is still running past its deadline
+    is killed and its task fails with TimeoutExpired.
+    """
+
+    def __init__(self, workers: int, timeout: float = 0) -> None:
+        self.workers = workers
+        self.timeout = timeout
+
+        self.context = multiprocessing.get_context("spawn")
+
+        self.waiting: list[Task] = []
+        self.running: list[Task] = []
+
+    def submit(self, function, *args, **kwargs) -> Task:
+        task = Task(function, args, kwargs, self.timeout)
+        self.waiting.append(task)
+
+        self._start()
+
+        return task
+
+    def _start(self) -> None:
+        self.waiting = [task for task in self.waiting if not task.cancelled()]
+
+        while len(self.waiting) > 0 and len(self.running) < self.workers:
+            task = self.waiting.pop(0)
+            task.start(self.context)
+
+            self.running.append(task)
+
+    def wait(self, tasks, timeout: float | None = None) -> set:
+        """Returns the tasks that are done, waiting up to timeout seconds for one"""
+        end = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            for task in list(self.running):
+                if task.poll():
+                    self.running.remove(task)
+
+            self._start()
+
+            done = {task for task in tasks if task.done()}
+            if len(done) > 0:
+                return done
+
+            now = time.monotonic()
+            if end is not None and now >= end:
+                return done
+
+            # Sleeps until a child reports, exits or reaches its deadline
+            deadlines = [task.deadline for task in self.running if task.deadline is not None]
+            if end is not None:
+                deadlines.append(end)
+
+            wait_timeout = max(0, min(deadlines) - now) if len(deadlines) > 0 else None
+
+            objects = [task.connection for task in self.running]
+            objects += [task.process.sentinel for task in self.running]
+
+            wait_for(objects, timeout=wait_timeout)
+
+    def shutdown(self) -> None:
+        for task in self.waiting:
+            task.cancel()
+
+        for task in self.running:
+            task.kill()
+
+        self.waiting.clear()
+        self.running.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+
+
+if __name__ == "__main__":
+    pass
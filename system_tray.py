@@ -4,7 +4,20 @@ from PIL import Image
 
 from pystray import Icon, Menu, MenuItem
 
-from functions import show_console, hide_console, close_console, read_yaml, write_yaml
+from functions import (
+    show_console,
+    hide_console,
+    close_console,
+    read_yaml,
+    write_yaml,
+    get_config,
+    get_ocr_config,
+    get_profiler,
+)
+
+
+# Documents profiled per click on 'Profile next documents'
+PROFILE_NEXT = 5
 
 
 class SystemTray:
@@ -14,11 +27,12 @@ class SystemTray:
 
     def __init__(self):
         # self.redo_ocr = read_yaml("ocr.yaml")["redo_ocr"]
-        self.output_txt = read_yaml("ocr.yaml")["output_txt"]
+        self.output_txt = get_ocr_config().output_txt
 
-        self.force_rescan = read_yaml("config.yaml")["force_rescan"]
-        self.show_console = read_yaml("config.yaml")["show_console"]
-        self.notifications = read_yaml("config.yaml")["notifications"]
+        config = get_config()
+        self.force_rescan = config.force_rescan
+        self.show_console = config.show_console
+        self.notifications = config.notifications
 
         if self.show_console == False:
             hide_console()
@@ -60,6 +74,11 @@ class SystemTray:
                     action=self.ot_handler,
                     checked=lambda MenuItem: self.output_txt,
                 ),
+                MenuItem(
+                    f"Profile next {PROFILE_NEXT} documents",
+                    action=self.profile_handler,
+                    checked=lambda MenuItem: get_profiler().remaining > 0,
+                ),
                 Menu.SEPARATOR,
                 MenuItem("Exit", action=self.exit_, checked=None),
             ),
@@ -77,7 +96,7 @@ class SystemTray:
         self.output_txt = not MenuItem.checked
         self.icon.update_menu()
 
-        ocr = read_yaml("ocr.yaml")
+        ocr = read_yaml("ocr.yaml", cached=False)
         ocr["output_txt"] = self.output_txt
         write_yaml("ocr.yaml", ocr)
 
@@ -85,10 +104,14 @@ class SystemTray:
         self.force_rescan = not MenuItem.checked
         self.icon.update_menu()
 
-        config = read_yaml("config.yaml")
+        config = read_yaml("config.yaml", cached=False)
         config["force_rescan"] = self.force_rescan
         write_yaml("config.yaml", config)
 
+    def profile_handler(self, Icon, MenuItem):
+        get_profiler().request(PROFILE_NEXT)
+        self.icon.update_menu()
+
     def console_handler(self, Icon, MenuItem):
         self.show_console = not MenuItem.checked
         self.icon.update_menu()
@@ -98,7 +121,7 @@ class SystemTray:
         elif self.show_console == False:
             hide_console()
 
-        config = read_yaml("config.yaml")
+        config = read_yaml("config.yaml", cached=False)
         config["show_console"] = self.show_console
         write_yaml("config.yaml", config)
 
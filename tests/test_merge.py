@@ -0,0 +1,102 @@
+import pikepdf
+import pytest
+
+from ocr import split_pdf, merge_pdfs, prepare_chunks
+from pages import PageIndex
+from store import Store
+
+
+PAGE_SIZE = (595, 842)
+PDF_ID = "0" * 32
+
+
+def make_document(path, pages: int = 7) -> None:
+    """Pages with direct /Resources holding an indirect font, as ocrmypdf writes them,
+    a rotated third page and outlines
+    """
+    with pikepdf.new() as pdf:
+        font = pdf.make_indirect(
+            pikepdf.Dictionary(
+                Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1, BaseFont=pikepdf.Name.Helvetica
+            )
+        )
+
+        for n in range(pages):
+            page = pdf.add_blank_page(page_size=PAGE_SIZE)
+            page.Resources = pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font))
+            page.Contents = pdf.make_stream(f"BT /F1 12 Tf 72 720 Td (page {n + 1}) Tj ET".encode())
+            page.Rotate = 90 if n == 2 else 0
+
+        pdf.Root.Outlines = pdf.make_indirect(pikepdf.Dictionary(Type=pikepdf.Name.Outlines))
+        pdf.save(path)
+
+
+def fake_ocr(chunk) -> str:
+    """Stands in for ocrmypdf: adds a text layer to every page"""
+    with pikepdf.open(chunk) as pdf:
+        for page in pdf.pages:
+            page.Contents = pdf.make_stream(
+                page.Contents.read_bytes() + b" BT /F1 1 Tf 0 0 Td (ocr) Tj ET"
+            )
+
+        pdf.save(f"{chunk}.ocr")
+
+    return f"{chunk}.ocr"
+
+
+def test_split_merge_round_trip(tmp_path):
+    original = tmp_path / "original.pdf"
+    merged = tmp_path / "merged.pdf"
+    make_document(original)
+
+    chunks = split_pdf(original, tmp_path, 3)
+
+    assert len(chunks) == 3
+
+    merge_pdfs(original, [fake_ocr(chunk) for chunk in chunks], merged, PDF_ID)
+
+    with pikepdf.open(merged) as pdf:
+        assert len(pdf.pages) == 7
+        assert pdf.pages[2].Rotate == 90
+        assert "/Outlines" in pdf.Root
+        assert str(pdf.docinfo.Keywords) == f"md5 {PDF_ID}"
+
+        for n, page in enumerate(pdf.pages):
+            content = page.Contents.read_bytes()
+
+            assert f"(page {n + 1})".encode() in content
+            assert b"(ocr)" in content
+            assert "/F1" in page.Resources.Font
+
+
+def test_merge_rejects_missing_pages(tmp_path):
+    original = tmp_path / "original.pdf"
+    make_document(original)
+
+    chunks = [fake_ocr(chunk) for chunk in split_pdf(original, tmp_path, 3)]
+
+    with pytest.raises(ValueError):
+        merge_pdfs(original, chunks[:-1], tmp_path / "merged.pdf", PDF_ID)
+
+
+def test_prepare_chunks_selects_pages_per_chunk(tmp_path, monkeypatch):
+    import ocr
+
+    original = tmp_path / "original.pdf"
+    make_document(original)
+
+    store = Store(":memory:")
+    classes = ["text", "image", "text", "image", "image", "image", "blank"]
+
+    monkeypatch.setattr(ocr, "classify_pages", lambda i: classes)
+    monkeypatch.setattr(ocr, "open_store", lambda: store)
+
+    chunks = prepare_chunks(original, tmp_path, 3, PDF_ID, select=True)
+
+    # Page numbers are relative to the chunk; the document is recorded as a whole
+    assert [pages for (_, pages) in chunks] == ["2", None, ""]
+    assert PageIndex(store).lookup(PDF_ID) == (7, 2, 4, 1, "2,4-6")
+
+    chunks = prepare_chunks(original, tmp_path, 3, PDF_ID, select=False)
+
+    assert [pages for (_, pages) in chunks] == [None, None, None]
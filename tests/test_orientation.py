@@ -0,0 +1,81 @@
+import random
+
+import cv2
+import numpy as np
+import pytest
+
+from PIL import Image, ImageDraw, ImageFont
+
+from store import Store
+from orientation import OrientationCache, is_upright
+
+
+WORDS = (
+    "Lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+    "incididunt ut labore et dolore magna aliqua Ut enim ad minim veniam quis nostrud"
+).split()
+
+# A4 at 150 dpi
+IMAGE_SIZE = (1240, 1754)
+
+
+def render_page(size: int, seed: int):
+    """An RGB page of random words in the default font, size px high"""
+    rng = random.Random(seed)
+    font = ImageFont.load_default(size)
+
+    im = Image.new("L", IMAGE_SIZE, 255)
+    draw = ImageDraw.Draw(im)
+
+    for y in range(150, IMAGE_SIZE[1] - 150, int(size * 1.5)):
+        draw.text((120, y), " ".join(rng.choices(WORDS, k=rng.randint(3, 12))), fill=0, font=font)
+
+    return cv2.cvtColor(np.array(im), cv2.COLOR_GRAY2RGB)
+
+
+PAGES = [(size, seed) for size in [18, 24, 32] for seed in range(2)]
+
+
+@pytest.mark.parametrize("size, seed", PAGES)
+def test_upright_page(size, seed):
+    assert is_upright(render_page(size, seed)) is True
+
+
+@pytest.mark.parametrize("size, seed", PAGES)
+@pytest.mark.parametrize(
+    "rotation", [cv2.ROTATE_180, cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE]
+)
+def test_turned_page(size, seed, rotation):
+    assert is_upright(cv2.rotate(render_page(size, seed), rotation)) is False
+
+
+def test_blank_page():
+    assert is_upright(np.full((*IMAGE_SIZE[::-1], 3), 255, np.uint8)) is False
+
+
+def test_upright_pages_skip_osd(monkeypatch):
+    # Windows-only imports
+    preprocessor = pytest.importorskip("preprocessor")
+
+    calls = []
+
+    def image_to_osd(im, output_type=None):
+        calls.append(im.shape)
+
+        return {"orientation": 180, "rotate": 180}
+
+    monkeypatch.setattr(preprocessor.pytesseract, "image_to_osd", image_to_osd)
+    monkeypatch.setattr(
+        preprocessor, "_get_orientation_cache", lambda: OrientationCache(Store(":memory:"))
+    )
+
+    for size, seed in PAGES:
+        im = render_page(size, seed)
+
+        assert preprocessor.PdfPreprocessor._rotate_image(im) is im
+
+    assert len(calls) == 0
+
+    preprocessor.PdfPreprocessor._rotate_image(cv2.rotate(render_page(24, 0), cv2.ROTATE_180))
+
+    assert len(calls) == 1
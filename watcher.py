@@ -0,0 +1,180 @@
+import os
+import time
+
+from threading import Thread, Event, Lock
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # Falls back to polling
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class _Handler(FileSystemEventHandler):
+    def __init__(self, watcher) -> None:
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher.touch(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.touch(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.watcher.touch(event.dest_path)
+
+    def on_closed(self, event):
+        # inotify IN_CLOSE_WRITE: the writer is done with the file
+        if not event.is_directory:
+            self.watcher.touch(event.src_path, closed=True)
+
+
+class Watcher:
+    """Queues new or changed pdfs and hands them over once they stop changing.
+
+    Uses filesystem notifications through watchdog (inotify on Linux, ReadDirectoryChangesW on Windows)
+    and falls back to polling file sizes and modification times if watchdog is not installed.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        callback,
+        exclude: str = "",
+        exts: list = ["pdf"],
+        debounce: float = 5,
+        poll_interval: float = 10,
+    ) -> None:
+        self.path = os.path.abspath(path)
+        self.callback = callback
+        self.exclude = exclude
+        self.exts = exts
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+
+        # path -> (time of last event, (size, mtime) at that time)
+        self.pending: dict[str, tuple] = {}
+        self.lock = Lock()
+        self.stopped = Event()
+
+        self.observer = None
+        self.threads: list[Thread] = []
+
+    def _is_wanted(self, path: str) -> bool:
+        if path.rsplit(".", 1)[-1].lower() not in self.exts:
+            return False
+
+        if self.exclude:
+            relpath = os.path.relpath(path, self.path)
+            if self.exclude in relpath.split(os.sep)[:-1]:
+                return False
+
+        return True
+
+    def _signature(self, path: str) -> tuple | None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def touch(self, path: str, closed: bool = False) -> None:
+        if not self._is_wanted(path):
+            return
+
+        # A closed file only has to survive one more stability check
+        now = time.monotonic() - (self.debounce if closed else 0)
+
+        with self.lock:
+            self.pending[path] = (now, self._signature(path))
+
+    def discard(self, files: list) -> None:
+        """Drops events caused by processing the files themselves"""
+        with self.lock:
+            for (_, path) in files:
+                self.pending.pop(path, None)
+
+    def _take_ready(self) -> list:
+        ready = []
+        now = time.monotonic()
+
+        with self.lock:
+            for path, (last_event, signature) in list(self.pending.items()):
+                if now - last_event < self.debounce:
+                    continue
+
+                current = self._signature(path)
+                if current is None:
+                    # Deleted or moved away
+                    del self.pending[path]
+                elif current != signature:
+                    # Still being written
+                    self.pending[path] = (now, current)
+                else:
+                    del self.pending[path]
+                    ready.append((os.path.basename(path), path))
+
+        return ready
+
+    def _dispatch(self) -> None:
+        while not self.stopped.wait(1):
+            ready = self._take_ready()
+            if len(ready) == 0:
+                continue
+
+            try:
+                self.callback(ready)
+            except Exception as e:
+                print(str(e))
+
+    def _poll(self) -> None:
+        snapshot = None
+
+        while not self.stopped.is_set():
+            current = {}
+            for root, dirs, files in os.walk(self.path):
+                if self.exclude in dirs:
+                    dirs.remove(self.exclude)
+                for name in files:
+                    path = os.path.join(root, name)
+                    if self._is_wanted(path):
+                        current[path] = self._signature(path)
+
+            if snapshot is not None:
+                for path, signature in current.items():
+                    if snapshot.get(path) != signature:
+                        self.touch(path)
+
+            snapshot = current
+
+            self.stopped.wait(self.poll_interval)
+
+    def start(self) -> None:
+        if Observer is not None:
+            self.observer = Observer()
+            self.observer.schedule(_Handler(self), self.path, recursive=True)
+            self.observer.start()
+        else:
+            print("watchdog is not installed. Watching for new files by polling...")
+            self.threads.append(Thread(target=self._poll, daemon=True))
+
+        self.threads.append(Thread(target=self._dispatch, daemon=True))
+
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,126 @@
+import os
+import time
+
+from store import Store
+from fingerprints import stat_signature
+
+
+DISCOVERED = "discovered"
+BACKED_UP = "backed-up"
+DECRYPTED = "decrypted"
+OCR_RUNNING = "ocr-running"
+DONE = "done"
+FAILED = "failed"
+
+
+class WorkQueue:
+    """Durable per-file state machine:
+
+    discovered -> backed-up -> decrypted -> ocr-running -> done | failed
+
+    Every state is stored with the file's (size, mtime, inode) signature as of that state,
+    so a restart resumes where it stopped and files that are done are skipped without being
+    opened until they change -- unless their PDF ID is marked problematic in the ledger.
+    """
+
+    def __init__(self, store: Store) -> None:
+        self.store = store
+
+        self.store.execute(
+            """CREATE TABLE IF NOT EXISTS work (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                updated REAL NOT NULL,
+                pdf_id TEXT
+            )"""
+        )
+
+        # Databases created before the PDF ID was stored
+        if "pdf_id" not in [row[1] for row in self.store.execute("PRAGMA table_info(work)")]:
+            self.store.execute("ALTER TABLE work ADD COLUMN pdf_id TEXT")
+
+        self.store.commit()
+
+    def discover(self, files: list, complete: bool = False, forced: set = frozenset()) -> list:
+        """Returns the files that still have work to do. New and changed files start over.
+
+        Done files whose PDF ID is in forced (problematic in the ledger) go back to decrypted.
+        With complete=True, files is the whole working directory and entries of files
+        that no longer exist are dropped.
+        """
+        rows = {
+            path: (tuple(signature), state, pdf_id)
+            for (path, *signature, state, pdf_id) in self.store.execute(
+                "SELECT path, size, mtime_ns, inode, state, pdf_id FROM work"
+            )
+        }
+
+        pending = []
+        for (name, path) in files:
+            key = os.path.abspath(path)
+
+            try:
+                signature = stat_signature(path)
+            except OSError:
+                continue
+
+            row = rows.get(key)
+
+            if row is None or row[0] != signature:
+                self._set(key, signature, DISCOVERED)
+            elif row[1] == DONE:
+                if row[2] not in forced:
+                    continue
+
+                self._set(key, signature, DECRYPTED, row[2])
+
+            pending.append((name, path))
+
+        if complete:
+            listed = {os.path.abspath(path) for (_, path) in files}
+
+            self.store.executemany(
+                "DELETE FROM work WHERE path = ?",
+                [(path,) for path in rows if path not in listed],
+            )
+
+        self.store.commit()
+
+        return pending
+
+    def state(self, path: str) -> str | None:
+        row = self.store.fetchone(
+            "SELECT state FROM work WHERE path = ?", (os.path.abspath(path),)
+        )
+
+        return row[0] if row else None
+
+    def advance(self, path: str, state: str, pdf_id: str | None = None) -> None:
+        """Moves a file to state, recording its current signature and, if given, its PDF ID"""
+        try:
+            signature = stat_signature(path)
+        except OSError:
+            return
+
+        self._set(os.path.abspath(path), signature, state, pdf_id)
+        self.store.commit()
+
+    def _set(self, key: str, signature: tuple, state: str, pdf_id: str | None = None) -> None:
+        self.store.execute(
+            """INSERT INTO work (path, size, mtime_ns, inode, state, updated, pdf_id) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (path) DO UPDATE SET
+                size = excluded.size,
+                mtime_ns = excluded.mtime_ns,
+                inode = excluded.inode,
+                state = excluded.state,
+                updated = excluded.updated,
+                pdf_id = coalesce(excluded.pdf_id, work.pdf_id)""",
+            (key, *signature, state, time.time(), pdf_id),
+        )
+
+
+if __name__ == "__main__":
+    pass